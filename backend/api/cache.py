@@ -0,0 +1,78 @@
+import json
+import time
+
+from hashlib import md5
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def get_reference_version(prefix):
+    """Возвращает текущую версию справочника и время его изменения."""
+    return cache.get_or_set(
+        f'{prefix}:version', (uuid4().hex, int(time.time())), None
+    )
+
+
+def invalidate_reference_cache(prefix):
+    cache.set(f'{prefix}:version', (uuid4().hex, int(time.time())), None)
+
+
+class CachedReferenceMixin:
+    """
+    Кэширует ответы list/retrieve справочника в кэше Django и отдаёт
+    ETag/Last-Modified, отвечая 304 на условные запросы. Кэш сбрасывается
+    сменой версии справочника (см. api.signals); чтобы сброс из команды или
+    другого воркера gunicorn был виден всем процессам, кэш должен быть
+    общим (CACHE_BACKEND), а не locmem.
+    """
+
+    cache_prefix = None
+
+    def cached_response(self, request, get_response):
+        version, last_modified = get_reference_version(self.cache_prefix)
+        key = f'{self.cache_prefix}:{version}:{request.get_full_path()}'
+        entry = cache.get(key)
+        if entry is None:
+            response = get_response()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            data = response.data
+            etag = '"{}"'.format(
+                md5(
+                    json.dumps(data, ensure_ascii=False).encode()
+                ).hexdigest()
+            )
+            entry = (data, etag)
+            cache.set(key, entry, settings.REFERENCE_CACHE_TIMEOUT)
+        data, etag = entry
+        response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # С response ответ 304 сохраняет заголовки ETag и Last-Modified.
+        not_modified = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified,
+            response=response,
+        )
+        return response if not_modified is None else not_modified
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CachedReferenceMixin, self).list(
+                request, *args, **kwargs
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CachedReferenceMixin, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core import checks
+
+from recipes.search import PROCESS_LOCAL_CACHES
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Сброс кэша справочников и ленты должен доходить до всех процессов."""
+    backend = settings.CACHES['default']['BACKEND']
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        checks.Warning(
+            f'Кэш {backend} виден только своему процессу.',
+            hint=(
+                'Сброс кэша справочников и ленты из команд manage.py и '
+                'других воркеров не дойдёт до остальных процессов, укажите '
+                'общий CACHE_BACKEND (например, Redis).'
+            ),
+            id='api.W001',
+        )
+    ]
@@ -0,0 +1,72 @@
+from hashlib import md5
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import Subscribe
+
+
+def user_version_key(user_id):
+    return f'feed:user:{user_id}'
+
+
+def author_version_key(author_id):
+    return f'feed:author:{author_id}'
+
+
+def get_versions(keys):
+    """
+    Возвращает версии по ключам одним запросом к кэшу. Отсутствующие
+    (новые или вытесненные) версии создаются заново, поэтому ранее
+    сохранённые страницы ленты по ним уже не найдутся.
+    """
+    versions = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions
+
+
+def get_followed_authors(user_id):
+    """Возвращает id авторов, на которых подписан пользователь, и версию."""
+    key = user_version_key(user_id)
+    user_version = get_versions([key])[key]
+    authors_key = f'feed:authors:{user_id}:{user_version}'
+    author_ids = cache.get(authors_key)
+    if author_ids is None:
+        author_ids = list(
+            Subscribe.objects.filter(user_id=user_id).values_list(
+                'author_id', flat=True
+            )
+        )
+        cache.set(authors_key, author_ids, settings.FEED_CACHE_TIMEOUT)
+    return author_ids, user_version
+
+
+def get_page_key(user_id, user_version, author_ids, url):
+    """
+    Ключ страницы ленты: меняется при изменении подписок, избранного или
+    списка покупок пользователя и при публикации рецепта любым из авторов.
+    """
+    keys = [author_version_key(pk) for pk in author_ids]
+    versions = get_versions(keys)
+    digest = md5(
+        ':'.join([user_version, *(versions[key] for key in keys), url])
+        .encode()
+    ).hexdigest()
+    return f'feed:page:{user_id}:{digest}'
+
+
+def invalidate_user_feed(user_id):
+    transaction.on_commit(
+        lambda: cache.delete(user_version_key(user_id))
+    )
+
+
+def invalidate_author_feeds(author_id):
+    transaction.on_commit(
+        lambda: cache.delete(author_version_key(author_id))
+    )
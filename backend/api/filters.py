@@ -1,16 +1,65 @@
+from django.db import connection
+from django.db.models import (
+    BooleanField,
+    Case,
+    Exists,
+    OuterRef,
+    Q,
+    Value,
+    When,
+)
 from django_filters.rest_framework import FilterSet, filters
 
 from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import search_recipes
 
 
 class IngredientSearchFilter(FilterSet):
-    """Поиск по названию ингредиента."""
+    """
+    Поиск по названию ингредиента: сначала совпадения по началу названия,
+    затем по вхождению. Параметр limit ограничивает размер выдачи.
+    """
 
-    name = filters.CharFilter(lookup_expr='istartswith')
+    name = filters.CharFilter(method='filter_name')
+    limit = filters.NumberFilter(method='filter_limit')
 
     class Meta:
         model = Ingredient
-        fields = ('name',)
+        fields = ('name', 'limit')
+
+    def filter_name(self, queryset, name, value):
+        if connection.vendor == 'postgresql':
+            matches = Q(name__icontains=value)
+            prefix = Q(name__istartswith=value)
+        else:
+            # LIKE в SQLite не учитывает регистр только для латиницы,
+            # поэтому сравнение выполняется в Python.
+            value = value.casefold()
+            prefix_ids, contains_ids = [], []
+            for pk, ingredient_name in queryset.values_list('pk', 'name'):
+                ingredient_name = ingredient_name.casefold()
+                if ingredient_name.startswith(value):
+                    prefix_ids.append(pk)
+                elif value in ingredient_name:
+                    contains_ids.append(pk)
+            matches = Q(pk__in=prefix_ids + contains_ids)
+            prefix = Q(pk__in=prefix_ids)
+        return (
+            queryset.filter(matches)
+            .annotate(
+                is_prefix=Case(
+                    When(prefix, then=Value(True)),
+                    default=Value(False),
+                    output_field=BooleanField(),
+                )
+            )
+            .order_by('-is_prefix', 'name')
+        )
+
+    def filter_limit(self, queryset, name, value):
+        if value > 0:
+            return queryset[: int(value)]
+        return queryset
 
 
 class RecipeSearchFilter(FilterSet):
@@ -20,15 +69,41 @@ class RecipeSearchFilter(FilterSet):
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
     )
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'tags',
+            'author',
+            'is_favorited',
+            'is_in_shopping_cart',
+            'search',
+            'ordering',
+        )
+
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        # EXISTS по связующей таблице вместо JOIN + DISTINCT: рецепты
+        # не дублируются, а стоимость не растёт с числом выбранных тэгов.
+        return queryset.filter(
+            Exists(
+                Recipe.tags.through.objects.filter(
+                    recipe=OuterRef('pk'), tag__in=value
+                )
+            )
+        )
 
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
@@ -41,3 +116,11 @@ class RecipeSearchFilter(FilterSet):
         if value and not user.is_anonymous:
             return queryset.filter(shopping_cart__user=user)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        if value == 'popular':
+            return queryset.order_by('-favorites_count', '-pub_date')
+        return queryset
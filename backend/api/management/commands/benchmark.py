@@ -0,0 +1,247 @@
+import csv
+import io
+import json
+import random
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    ShoppingListItem,
+    Subscribe,
+    Tag,
+)
+from users.models import CustomUser
+
+# Отдельный кэш процесса, чтобы замер не читал и не сбрасывал ключи
+# рабочего кэша (Redis и т.п.).
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    }
+}
+
+# Сколько ингредиентов создать, если их нет ни в файле, ни в основной базе.
+GENERATED_INGREDIENTS = 2000
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный замер API: заполняет тестовую базу синтетическими '
+        'данными и выводит перцентили времени ответа и число SQL-запросов '
+        'по каждому эндпоинту в формате JSON. Тестовая база создаётся '
+        'рядом с основной и удаляется после замера, миграции должны быть '
+        'созданы заранее (makemigrations). Замер идёт с отдельным '
+        'кэшем в памяти, который очищается перед каждым запросом.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=100,
+        )
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=1000,
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=30,
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+        )
+        parser.add_argument(
+            '--ingredients-file',
+            help=(
+                'CSV (name,measurement_unit), по умолчанию ингредиенты из '
+                'основной базы, а если их нет - сгенерированные'
+            ),
+        )
+        parser.add_argument(
+            '--noinput',
+            '--no-input',
+            action='store_false',
+            dest='interactive',
+            help='Удалять оставшуюся тестовую базу без подтверждения',
+        )
+        parser.add_argument(
+            '--output',
+            help='Файл для результатов, по умолчанию stdout',
+        )
+
+    @override_settings(CACHES=BENCHMARK_CACHES)
+    def handle(self, *args, **options):
+        ingredients = self.load_ingredients(options['ingredients_file'])
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0,
+            autoclobber=not options['interactive'],
+            serialize=False,
+        )
+        try:
+            rng = random.Random(options['seed'])
+            user = self.seed(rng, ingredients, options)
+            results = {
+                'database': connection.vendor,
+                'dataset': {
+                    'users': options['users'],
+                    'recipes': options['recipes'],
+                    'ingredient_recipes': IngredientRecipe.objects.count(),
+                    'favorites': Favorite.objects.count(),
+                    'shopping_cart': ShoppingCart.objects.count(),
+                    'shopping_list_items': ShoppingListItem.objects.count(),
+                    'subscriptions': Subscribe.objects.count(),
+                },
+                'endpoints': self.measure(user, rng, options['repeat']),
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        output = json.dumps(results, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+    def load_ingredients(self, path):
+        """Ингредиенты читаются до переключения на тестовую базу."""
+        if path:
+            with open(path, encoding='utf-8') as file:
+                return [(row[0], row[1]) for row in csv.reader(file)]
+        ingredients = list(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+        )
+        return ingredients or [
+            (f'Ингредиент {number}', 'г')
+            for number in range(GENERATED_INGREDIENTS)
+        ]
+
+    def seed(self, rng, ingredients, options):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit=measurement_unit)
+            for name, measurement_unit in ingredients
+        )
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        CustomUser.objects.bulk_create(
+            CustomUser(
+                email=f'user{number}@example.com',
+                username=f'user{number}',
+                first_name='Имя',
+                last_name='Фамилия',
+            )
+            for number in range(options['users'])
+        )
+        user_ids = list(CustomUser.objects.values_list('id', flat=True))
+        Tag.objects.bulk_create(
+            Tag(
+                name=f'Тэг {number}',
+                color=f'#{number:06d}',
+                slug=f'tag{number}',
+            )
+            for number in range(5)
+        )
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        Recipe.objects.bulk_create(
+            Recipe(
+                author_id=rng.choice(user_ids),
+                name=f'Рецепт {number}',
+                text='Описание рецепта',
+                cooking_time=rng.randint(5, 120),
+            )
+            for number in range(options['recipes'])
+        )
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=rng.randint(1, 500),
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in rng.sample(ingredient_ids, rng.randint(3, 12))
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in rng.sample(tag_ids, rng.randint(1, 3))
+        )
+        for model, per_user in ((Favorite, 20), (ShoppingCart, 10)):
+            model.objects.bulk_create(
+                model(user_id=user_id, recipe_id=recipe_id)
+                for user_id in user_ids
+                for recipe_id in rng.sample(
+                    recipe_ids, min(per_user, len(recipe_ids))
+                )
+            )
+        Subscribe.objects.bulk_create(
+            Subscribe(user_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in rng.sample(user_ids, min(10, len(user_ids)))
+            if author_id != user_id
+        )
+        call_command('reconcile_counters', stdout=io.StringIO())
+        call_command('rebuild_shopping_lists', stdout=io.StringIO())
+        return CustomUser.objects.get(id=user_ids[0])
+
+    def measure(self, user, rng, repeat):
+        client = APIClient()
+        client.force_authenticate(user)
+        recipe_id = Recipe.objects.values_list('id', flat=True).first()
+        tag = Tag.objects.values_list('slug', flat=True).first()
+        prefix = Ingredient.objects.values_list('name', flat=True).first()[:3]
+        endpoints = {
+            'recipe_list': '/api/recipes/?limit=6',
+            'recipe_list_large': '/api/recipes/?limit=50',
+            'recipe_list_filtered': (
+                f'/api/recipes/?tags={tag}&is_favorited=1&limit=6'
+            ),
+            'recipe_detail': f'/api/recipes/{recipe_id}/',
+            'subscriptions': '/api/users/subscriptions/?recipes_limit=3',
+            'download_shopping_cart': '/api/recipes/download_shopping_cart/',
+            'ingredient_search': f'/api/ingredients/?name={prefix}',
+        }
+        results = {}
+        for name, url in endpoints.items():
+            timings = []
+            for _ in range(repeat + 1):
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    timings.append((time.perf_counter() - start) * 1000)
+            timings = timings[1:]
+            results[name] = {
+                'status': response.status_code,
+                'queries': len(queries),
+                'mean_ms': round(statistics.mean(timings), 3),
+                'p50_ms': round(percentile(timings, 50), 3),
+                'p90_ms': round(percentile(timings, 90), 3),
+                'p99_ms': round(percentile(timings, 99), 3),
+            }
+        return results
@@ -1,6 +1,50 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class LimitPageNumberPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class LimitCursorPagination(CursorPagination):
+    """
+    Курсорная (keyset) пагинация без подсчёта общего количества объектов.
+    Порядок берётся из queryset и дополняется id для однозначности.
+    """
+
+    page_size = 6
+    page_size_query_param = 'limit'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(
+            queryset.query.order_by or queryset.model._meta.ordering
+        )
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            direction = '-' if ordering and ordering[0].startswith('-') else ''
+            ordering += (f'{direction}id',)
+        return ordering
+
+
+class OptionalCursorPagination(LimitPageNumberPagination):
+    """
+    По умолчанию - пагинация limit/page. Если в запросе передан параметр
+    cursor (в том числе пустой для первой страницы), используется
+    курсорная пагинация.
+    """
+
+    cursor_pagination_class = LimitCursorPagination
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_paginator = self.cursor_pagination_class()
+        if cursor_paginator.cursor_query_param not in request.query_params:
+            self.cursor_paginator = None
+            return super().paginate_queryset(queryset, request, view)
+        self.cursor_paginator = cursor_paginator
+        self.display_page_controls = False
+        return cursor_paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -1,15 +1,23 @@
+import binascii
+
+from django.conf import settings
 from django.db import transaction
-from django.db.models import F
-from django.shortcuts import get_object_or_404
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers, status
 
+from recipes import shopping_list
+from recipes.images import (
+    PendingImage,
+    submit_pending_image,
+    validate_base64_image,
+)
 from recipes.models import (
     Favorite,
     Ingredient,
     IngredientRecipe,
     Recipe,
+    ShoppingListItem,
     Subscribe,
     Tag,
 )
@@ -35,12 +43,24 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
         return Subscribe.objects.filter(user=user, author=obj.id).exists()
 
 
+class BatchSerializer(serializers.Serializer):
+    """Сериализатор списка id для пакетных операций."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=500,
+    )
+
+
 class CustomUserCreateSerializer(UserCreateSerializer):
     """Сериализатор для регистрации пользователя."""
 
@@ -89,6 +109,20 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'amount', 'measurement_unit')
 
 
+class ShoppingListItemSerializer(serializers.ModelSerializer):
+    """Сериализатор для позиции списка покупок."""
+
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name', 'amount', 'measurement_unit')
+
+
 class AddIngredientSerializer(serializers.ModelSerializer):
     """Сериализатор добавления ингредиента в рецепт."""
 
@@ -100,6 +134,36 @@ class AddIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
+class AsyncBase64ImageField(Base64ImageField):
+    """
+    При включённой настройке RECIPE_IMAGE_ASYNC только проверяет base64 и
+    формат; декодирование и сохранение выполняются в фоне после коммита.
+    """
+
+    def to_internal_value(self, data):
+        if not settings.RECIPE_IMAGE_ASYNC or not isinstance(data, str):
+            return super().to_internal_value(data)
+        if data in self.EMPTY_VALUES:
+            return None
+        try:
+            return validate_base64_image(data)
+        except binascii.Error:
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        except (OSError, ValueError):
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+
+
+class ImageVariantField(serializers.ImageField):
+    """Отдаёт уменьшенную копию изображения рецепта, если она создана."""
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        super().__init__(read_only=True, **kwargs)
+
+    def get_attribute(self, instance):
+        return getattr(instance, self.variant) or instance.image
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
     """Сериализатор для чтения рецепта."""
 
@@ -108,7 +172,7 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     )
     tags = TagSerializer(read_only=True, many=True)
     author = CustomUserSerializer(read_only=True)
-    image = Base64ImageField(required=False, allow_null=True)
+    image = ImageVariantField('image_medium')
     is_favorited = serializers.SerializerMethodField(
         method_name='get_is_favorited', read_only=True
     )
@@ -124,6 +188,7 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             'author',
             'ingredients',
             'image',
+            'image_pending',
             'name',
             'text',
             'cooking_time',
@@ -132,22 +197,24 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         )
 
     def get_ingredients(self, obj):
-        recipe = obj
-        ingredients = recipe.ingredients.values(
-            'id',
-            'name',
-            'measurement_unit',
-            amount=F('ingredientrecipe__amount'),
-        )
-        return ingredients
+        ingredients = getattr(obj, 'recipe_ingredients', None)
+        if ingredients is None:
+            ingredients = obj.ingredientrecipe_set.select_related(
+                'ingredient'
+            ).order_by('ingredient__name')
+        return IngredientRecipeSerializer(ingredients, many=True).data
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
         return user.favorites.filter(recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
@@ -165,7 +232,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
     tags = serializers.PrimaryKeyRelatedField(
         many=True, queryset=Tag.objects.all()
     )
-    image = Base64ImageField(required=False, allow_null=True)
+    image = AsyncBase64ImageField(required=False, allow_null=True)
 
     class Meta:
         model = Recipe
@@ -173,16 +240,20 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         read_only_fields = ('author',)
 
     def validate(self, data):
-        ingredients = self.initial_data.get('ingredients')
-        ingredient_list = []
-
-        for items in ingredients:
-            ingredient = get_object_or_404(Ingredient, id=items['id'])
-            if ingredient in ingredient_list:
-                raise serializers.ValidationError(
-                    'Ингредиент уже добавлен в список!'
-                )
-            ingredient_list.append(ingredient)
+        ingredients = data['ingredients']
+        ingredient_ids = [item['id'] for item in ingredients]
+        if len(set(ingredient_ids)) != len(ingredient_ids):
+            raise serializers.ValidationError(
+                'Ингредиент уже добавлен в список!'
+            )
+        ingredient_objects = Ingredient.objects.in_bulk(ingredient_ids)
+        missing = set(ingredient_ids) - ingredient_objects.keys()
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиентов с id '
+                + ', '.join(map(str, sorted(missing)))
+                + ' нет в базе!'
+            )
 
         for ingredient in ingredients:
             if int(ingredient['amount']) <= 0:
@@ -190,15 +261,16 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                     {'Количество ингридиентов не может быть отрицательным!'}
                 )
 
-        tags = data['tags']
-
-        if not tags:
+        if not data['tags']:
             raise serializers.ValidationError('У рецепта нет ни одного тэга!')
-        for tag_name in tags:
-            if not Tag.objects.filter(name=tag_name).exists():
-                raise serializers.ValidationError(
-                    f'{tag_name} нет в списке тэгов!'
-                )
+
+        data['ingredients'] = [
+            {
+                'ingredient': ingredient_objects[item['id']],
+                'amount': item['amount'],
+            }
+            for item in ingredients
+        ]
         return data
 
     def validate_cooking_time(self, data):
@@ -213,7 +285,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         IngredientRecipe.objects.bulk_create(
             [
                 IngredientRecipe(
-                    ingredient=Ingredient.objects.get(id=ingredient['id']),
+                    ingredient=ingredient['ingredient'],
                     recipe=recipe,
                     amount=ingredient['amount'],
                 )
@@ -221,24 +293,77 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             ]
         )
 
+    def pop_pending_image(self, validated_data):
+        image = validated_data.get('image')
+        if not isinstance(image, PendingImage):
+            if 'image' in validated_data:
+                # Новое изображение отменяет ещё не сохранённое.
+                validated_data['image_pending'] = False
+                validated_data['image_token'] = None
+            return None
+        del validated_data['image']
+        validated_data['image_pending'] = True
+        validated_data['image_token'] = image.token
+        return image
+
+    def schedule_pending_image(self, recipe, image):
+        if image is not None:
+            transaction.on_commit(
+                lambda: submit_pending_image(recipe.id, image)
+            )
+
     @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
+        pending_image = self.pop_pending_image(validated_data)
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self.add_ingredients(recipe=recipe, ingredients=ingredients)
+        self.schedule_pending_image(recipe, pending_image)
         return recipe
 
+    def update_ingredients(self, ingredients, recipe):
+        current = {
+            item.ingredient_id: item
+            for item in recipe.ingredientrecipe_set.all()
+        }
+        created, changed = [], []
+        deltas = {}
+        for ingredient in ingredients:
+            item = current.pop(ingredient['ingredient'].id, None)
+            if item is None:
+                created.append(
+                    IngredientRecipe(
+                        ingredient=ingredient['ingredient'],
+                        recipe=recipe,
+                        amount=ingredient['amount'],
+                    )
+                )
+                deltas[ingredient['ingredient'].id] = ingredient['amount']
+            elif item.amount != ingredient['amount']:
+                deltas[item.ingredient_id] = ingredient['amount'] - item.amount
+                item.amount = ingredient['amount']
+                changed.append(item)
+        if current:
+            IngredientRecipe.objects.filter(
+                pk__in=[item.pk for item in current.values()]
+            ).delete()
+            for item in current.values():
+                deltas[item.ingredient_id] = -item.amount
+        IngredientRecipe.objects.bulk_update(changed, ('amount',))
+        IngredientRecipe.objects.bulk_create(created)
+        shopping_list.change_recipe(recipe, deltas)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
+        pending_image = self.pop_pending_image(validated_data)
         instance = super().update(instance, validated_data)
-        instance.tags.clear()
         instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.add_ingredients(recipe=instance, ingredients=ingredients)
-        instance.save()
+        self.update_ingredients(recipe=instance, ingredients=ingredients)
+        self.schedule_pending_image(instance, pending_image)
         return instance
 
     def to_representation(self, instance):
@@ -250,7 +375,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
 class RecipeShortSerializer(serializers.ModelSerializer):
     """Вспомогательный сериализатор."""
 
-    image = Base64ImageField(required=False, allow_null=True)
+    image = ImageVariantField('image_small')
 
     class Meta:
         model = Recipe
@@ -297,21 +422,23 @@ class SubscribeSerializer(CustomUserSerializer):
         return data
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes_limit = request.GET.get('recipes_limit')
-        recipes = Recipe.objects.filter(author=obj.author)
-        if recipes_limit:
-            recipes = recipes[: int(recipes_limit)]
+        recipes = getattr(obj.author, 'limited_recipes', None)
+        if recipes is None:
+            request = self.context.get('request')
+            recipes_limit = request.GET.get('recipes_limit', '')
+            recipes = Recipe.objects.filter(author=obj.author)
+            if recipes_limit.isdigit():
+                recipes = recipes[: int(recipes_limit)]
         serializer = RecipeShortSerializer(recipes, many=True)
         return serializer.data
 
     def get_is_subscribed(self, obj):
-        return Subscribe.objects.filter(
-            user=obj.user, author=obj.author
-        ).exists()
+        return True
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.author).count()
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
+        return obj.author.recipe.count()
 
 
 class FavoriteSerializer(RecipeShortSerializer):
@@ -0,0 +1,431 @@
+import base64
+import json
+import os
+import tempfile
+
+from io import BytesIO
+from unittest import mock, skipUnless
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from recipes import shopping_list
+from recipes.images import PendingImage, store_pending_image
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    ShoppingListItem,
+    Subscribe,
+    Tag,
+)
+from users.models import CustomUser
+
+PAGE_SIZES = (6, 50, 200)
+
+
+class RecipeDataTestCase(APITestCase):
+    """Пользователи с подписками, избранным и списком покупок и рецепты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            CustomUser.objects.create(
+                email=f'user{number}@example.com',
+                username=f'user{number}',
+                first_name='Имя',
+                last_name='Фамилия',
+            )
+            for number in range(5)
+        ]
+        cls.user = cls.users[0]
+        tags = [
+            Tag.objects.create(
+                name=f'Тэг {number}',
+                color=f'#00000{number}',
+                slug=f'tag{number}',
+            )
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(10)
+        ]
+        for number in range(max(PAGE_SIZES)):
+            recipe = Recipe.objects.create(
+                author=cls.users[number % len(cls.users)],
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=10,
+            )
+            recipe.tags.set(tags[: number % len(tags) + 1])
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
+                    recipe=recipe,
+                    ingredient=ingredients[
+                        (number + shift) % len(ingredients)
+                    ],
+                    amount=shift + 1,
+                )
+                for shift in range(3)
+            )
+            if number % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if number % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Subscribe.objects.bulk_create(
+            Subscribe(user=cls.user, author=author) for author in cls.users[1:]
+        )
+        shopping_list.rebuild([cls.user.id])
+
+
+class ReferenceCacheTest(RecipeDataTestCase):
+    """Условный запрос к справочнику получает 304 с теми же заголовками."""
+
+    def test_not_modified_keeps_etag(self):
+        response = self.client.get('/api/tags/')
+        etag = response['ETag']
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('Last-Modified', response)
+
+
+class RecipeListQueriesTest(RecipeDataTestCase):
+    """Количество запросов списка рецептов не зависит от размера страницы."""
+
+    def assert_list_queries(self, expected):
+        for page_size in PAGE_SIZES:
+            with self.subTest(page_size=page_size):
+                with self.assertNumQueries(expected):
+                    response = self.client.get(
+                        '/api/recipes/', {'limit': page_size}
+                    )
+                self.assertEqual(len(response.data['results']), page_size)
+
+    def test_authenticated_list(self):
+        self.client.force_authenticate(self.user)
+        self.assert_list_queries(5)
+
+    def test_anonymous_list(self):
+        self.assert_list_queries(4)
+
+
+class ShoppingListQueriesTest(RecipeDataTestCase):
+    """
+    Список покупок обновляется фиксированным числом запросов независимо от
+    количества рецептов, ингредиентов и пользователей с рецептом в корзине.
+    """
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def assert_shopping_lists_match_rebuild(self):
+        current = set(
+            ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            )
+        )
+        shopping_list.rebuild(CustomUser.objects.values('pk'))
+        self.assertEqual(
+            current,
+            set(
+                ShoppingListItem.objects.values_list(
+                    'user_id', 'ingredient_id', 'amount'
+                )
+            ),
+        )
+
+    def test_cart_batch(self):
+        ShoppingCart.objects.filter(user=self.user).delete()
+        shopping_list.rebuild([self.user.id])
+        ids = list(Recipe.objects.values_list('id', flat=True))
+        for batch in (ids[:2], ids[2:]):
+            with self.subTest(size=len(batch)):
+                with self.assertNumQueries(10):
+                    response = self.client.post(
+                        '/api/recipes/shopping_cart/',
+                        {'ids': batch},
+                        format='json',
+                    )
+                self.assertEqual(response.status_code, 200)
+                with self.assertNumQueries(8):
+                    response = self.client.delete(
+                        '/api/recipes/shopping_cart/',
+                        {'ids': batch},
+                        format='json',
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assert_shopping_lists_match_rebuild()
+
+    def test_recipe_edit(self):
+        recipe = Recipe.objects.filter(author=self.user).first()
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=user, recipe=recipe)
+            for user in self.users
+            if not ShoppingCart.objects.filter(
+                user=user, recipe=recipe
+            ).exists()
+        )
+        shopping_list.rebuild(CustomUser.objects.values('pk'))
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+        tags = list(recipe.tags.values_list('id', flat=True))
+        for used in (ingredients[:2], ingredients[5:]):
+            with self.subTest(ingredients=len(used)):
+                with self.assertNumQueries(19):
+                    response = self.client.patch(
+                        f'/api/recipes/{recipe.id}/',
+                        {
+                            'ingredients': [
+                                {'id': pk, 'amount': pk + 1} for pk in used
+                            ],
+                            'tags': tags,
+                            'name': 'Рецепт',
+                            'text': 'Описание',
+                            'cooking_time': 10,
+                        },
+                        format='json',
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assert_shopping_lists_match_rebuild()
+
+
+class DuplicateRequestTest(RecipeDataTestCase):
+    """
+    Повторный запрос на добавление получает 400, даже если предварительной
+    проверки нет (запросы пришли одновременно), и не меняет счётчики.
+    """
+
+    def setUp(self):
+        self.user = self.users[1]
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            author=self.users[2],
+            name='Рецепт',
+            text='Описание',
+            cooking_time=5,
+        )
+
+    def assert_duplicate_rejected(self, url):
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+
+    def test_recipe_relations(self):
+        for name, counter in (
+            ('favorite', 'favorites_count'),
+            ('shopping_cart', 'carts_count'),
+        ):
+            with self.subTest(name=name):
+                self.assert_duplicate_rejected(
+                    f'/api/recipes/{self.recipe.id}/{name}/'
+                )
+                self.recipe.refresh_from_db()
+                self.assertEqual(getattr(self.recipe, counter), 1)
+
+    def test_subscribe(self):
+        self.assert_duplicate_rejected(
+            f'/api/users/{self.users[2].id}/subscribe/'
+        )
+        self.assertEqual(
+            Subscribe.objects.filter(
+                user=self.user, author=self.users[2]
+            ).count(),
+            1,
+        )
+
+
+def find_seq_scans(plan):
+    nodes, tables = [plan], []
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan':
+            tables.append(node['Relation Name'])
+        nodes.extend(node.get('Plans', ()))
+    return tables
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN только в PostgreSQL')
+class QueryPlanTest(RecipeDataTestCase):
+    """
+    Запросы основных эндпоинтов не должны читать таблицы целиком. На
+    тестовых объёмах планировщик и так выбрал бы последовательное чтение,
+    поэтому оно запрещается, и Seq Scan в плане означает, что подходящего
+    индекса нет.
+    """
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def assert_no_seq_scans(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(context.captured_queries)
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            for query in context.captured_queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {query["sql"]}')
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                self.assertEqual(
+                    find_seq_scans(plan[0]['Plan']), [], query['sql']
+                )
+            cursor.execute('RESET enable_seqscan')
+
+    def test_recipe_list(self):
+        self.assert_no_seq_scans('/api/recipes/', {'limit': 50})
+
+    def test_recipe_list_cursor(self):
+        self.assert_no_seq_scans('/api/recipes/', {'cursor': ''})
+
+    def test_recipe_filters(self):
+        self.assert_no_seq_scans(
+            '/api/recipes/', {'tags': ['tag0', 'tag1'], 'author': self.user.id}
+        )
+        self.assert_no_seq_scans('/api/recipes/', {'is_favorited': 1})
+        self.assert_no_seq_scans('/api/recipes/', {'is_in_shopping_cart': 1})
+
+    def test_download_shopping_cart(self):
+        self.assert_no_seq_scans('/api/recipes/download_shopping_cart/')
+
+    def test_subscriptions(self):
+        self.assert_no_seq_scans(
+            '/api/users/subscriptions/', {'recipes_limit': 3}
+        )
+
+
+class DownloadShoppingCartTest(RecipeDataTestCase):
+    """Список покупок выгружается в каждом из поддерживаемых форматов."""
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def download(self, file_format):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/',
+            {'file_format': file_format},
+        )
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_text_formats(self):
+        for file_format in ('txt', 'csv'):
+            with self.subTest(file_format=file_format):
+                self.assertIn(
+                    'Ингредиент 0', self.download(file_format).decode()
+                )
+
+    def test_pdf_embeds_cyrillic_font(self):
+        content = self.download('pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertIn(b'/FontFile2', content)
+
+    def test_unknown_format(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'file_format': 'doc'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+def make_image(size=(900, 600), mode='RGB', color=(200, 10, 10)):
+    buffer = BytesIO()
+    Image.new(mode, size, color).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+@override_settings(RECIPE_IMAGE_ASYNC=True)
+class AsyncRecipeImageTest(RecipeDataTestCase):
+    """Изображение декодируется и сохраняется только после коммита."""
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def store(self, recipe_id, pending_image):
+        with mock.patch('recipes.images.close_old_connections'):
+            store_pending_image(recipe_id, pending_image)
+
+    def post_recipe(self, url='/api/recipes/', method='post', **fields):
+        data = {
+            'ingredients': [
+                {'id': Ingredient.objects.first().id, 'amount': 10}
+            ],
+            'tags': [Tag.objects.first().id],
+            'image': make_image(),
+            'name': 'Рецепт с изображением',
+            'text': 'Описание',
+            'cooking_time': 5,
+            **fields,
+        }
+        with mock.patch('api.serializers.submit_pending_image') as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = getattr(self.client, method)(
+                    url, data, format='json'
+                )
+        return response, submit
+
+    def test_rejected_recipe_leaves_no_files(self):
+        for fields in (
+            {'ingredients': [{'id': 10 ** 6, 'amount': 1}]},
+            {'cooking_time': 0},
+        ):
+            with self.subTest(fields=fields):
+                with mock.patch(
+                    'recipes.images.tempfile.TemporaryFile'
+                ) as temporary_file:
+                    response, submit = self.post_recipe(**fields)
+                self.assertEqual(response.status_code, 400)
+                submit.assert_not_called()
+                temporary_file.assert_not_called()
+        self.assertEqual(
+            [files for _, _, files in os.walk(self.media_root) if files], []
+        )
+
+    def test_image_is_stored_after_commit(self):
+        response, submit = self.post_recipe()
+        self.assertEqual(response.status_code, 201)
+        recipe_id, pending_image = submit.call_args[0]
+        self.assertIsInstance(pending_image, PendingImage)
+        recipe = Recipe.objects.get(pk=recipe_id)
+        self.assertTrue(recipe.image_pending)
+        self.store(recipe_id, pending_image)
+        recipe.refresh_from_db()
+        self.assertFalse(recipe.image_pending)
+        self.assertTrue(recipe.image)
+        self.assertTrue(recipe.image_small)
+
+    def test_older_image_does_not_overwrite_newer(self):
+        response, submit = self.post_recipe()
+        recipe_id, first = submit.call_args[0]
+        _, submit = self.post_recipe(
+            url=f'/api/recipes/{recipe_id}/',
+            method='patch',
+            image=make_image(color=(10, 200, 10)),
+        )
+        _, second = submit.call_args[0]
+        self.store(recipe_id, second)
+        recipe = Recipe.objects.get(pk=recipe_id)
+        image = recipe.image.name
+        self.store(recipe_id, first)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image.name, image)
+        self.assertFalse(recipe.image_pending)
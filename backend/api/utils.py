@@ -0,0 +1,109 @@
+import csv
+
+from io import BytesIO
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.response import Response
+
+PDF_FONT_NAME = 'ShoppingListFont'
+PDF_MARGIN = 20 * mm
+PDF_LINE_HEIGHT = 7 * mm
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def shopping_list_txt(ingredients):
+    """Построчно формирует список покупок в текстовом формате."""
+
+    for ingredient in ingredients:
+        yield (
+            f"- {ingredient['ingredient__name']}: {ingredient['total']} "
+            f"{ingredient['ingredient__measurement_unit']}\n"
+        )
+
+
+def shopping_list_csv(ingredients):
+    """Построчно формирует список покупок в формате CSV."""
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for ingredient in ingredients:
+        yield writer.writerow(
+            (
+                ingredient['ingredient__name'],
+                ingredient['total'],
+                ingredient['ingredient__measurement_unit'],
+            )
+        )
+
+
+def get_pdf_font():
+    """Регистрирует TTF-шрифт с кириллицей, встраиваемый в PDF."""
+    if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_PDF_FONT)
+        )
+    return PDF_FONT_NAME
+
+
+def shopping_list_pdf(ingredients):
+    """
+    Формирует список покупок в формате PDF. Список уже агрегирован в БД и
+    невелик, поэтому документ собирается в памяти и отдаётся одним блоком.
+    """
+    font = get_pdf_font()
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    pdf.setTitle('Список покупок')
+    _, height = A4
+    pdf.setFont(font, 16)
+    pdf.drawString(PDF_MARGIN, height - PDF_MARGIN, 'Список покупок')
+    pdf.setFont(font, 12)
+    y = height - PDF_MARGIN - 2 * PDF_LINE_HEIGHT
+    for ingredient in ingredients:
+        if y < PDF_MARGIN:
+            pdf.showPage()
+            pdf.setFont(font, 12)
+            y = height - PDF_MARGIN
+        pdf.drawString(
+            PDF_MARGIN,
+            y,
+            f"• {ingredient['ingredient__name']}: {ingredient['total']} "
+            f"{ingredient['ingredient__measurement_unit']}",
+        )
+        y -= PDF_LINE_HEIGHT
+    pdf.save()
+    yield buffer.getvalue()
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': (shopping_list_txt, 'text/plain; charset=utf-8'),
+    'csv': (shopping_list_csv, 'text/csv; charset=utf-8'),
+    'pdf': (shopping_list_pdf, 'application/pdf'),
+}
+
+
+def batch_response(ids, groups):
+    """
+    Ответ пакетной операции: статус для каждого переданного id. Id, не
+    попавшие ни в одну из групп, получают статус not_found.
+    """
+    results = []
+    for pk in dict.fromkeys(ids):
+        result = 'not_found'
+        for name, group in groups.items():
+            if pk in group:
+                result = name
+                break
+        results.append({'id': pk, 'status': result})
+    return Response({'results': results})
@@ -1,6 +1,17 @@
-from collections import Counter
-
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Count,
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Subquery,
+    Value,
+    prefetch_related_objects,
+)
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
@@ -13,27 +24,36 @@ from rest_framework.permissions import (
 )
 from rest_framework.response import Response
 
+from .cache import CachedReferenceMixin
+from .feed import get_followed_authors, get_page_key, invalidate_user_feed
 from .filters import IngredientSearchFilter, RecipeSearchFilter
-from .pagination import LimitPageNumberPagination
+from .pagination import LimitCursorPagination, OptionalCursorPagination
 from .permissions import IsAuthorOrAdminOrReadOnly
 from .serializers import (
+    BatchSerializer,
     CustomUserSerializer,
     IngredientSerializer,
     RecipeReadSerializer,
     RecipeShortSerializer,
     RecipeWriteSerializer,
+    ShoppingListItemSerializer,
     SubscribeSerializer,
     TagSerializer,
 )
+from .utils import SHOPPING_LIST_FORMATS, batch_response
+from recipes import shopping_list
 from recipes.models import (
     Favorite,
     Ingredient,
     IngredientRecipe,
     Recipe,
     ShoppingCart,
+    ShoppingListItem,
     Subscribe,
     Tag,
 )
+from recipes.recommendations import MAX_RECOMMENDATIONS, recommendation_index
+from recipes.search import ingredient_index
 from users.models import CustomUser
 
 
@@ -43,6 +63,18 @@ class CustomUserViewSet(UserViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = OptionalCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset
+        return queryset.annotate(
+            is_subscribed=Exists(
+                Subscribe.objects.filter(user=user, author=OuterRef('pk'))
+            )
+        )
 
     @action(
         detail=True,
@@ -52,36 +84,113 @@ class CustomUserViewSet(UserViewSet):
     def subscribe(self, request, id):
         author = get_object_or_404(CustomUser, id=id)
         if request.method == 'POST':
+            if author == request.user:
+                return Response(
+                    {'errors': 'Вы не можете подписаться на самого себя!'},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            # Проверкой служит уникальный индекс: повторный запрос,
+            # пришедший одновременно с первым, тоже получит 400, а не 500.
+            try:
+                with transaction.atomic():
+                    subscription = Subscribe.objects.create(
+                        user=request.user, author=author
+                    )
+            except IntegrityError:
+                return Response(
+                    {'errors': 'Вы уже подписаны на этого автора!'},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
             serializer = SubscribeSerializer(
-                Subscribe.objects.create(user=request.user, author=author),
-                context={'request': request},
+                subscription, context={'request': request}
             )
+            invalidate_user_feed(request.user.id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        Subscribe.objects.filter(user=request.user, author=author).delete()
+        if Subscribe.objects.filter(
+            user=request.user, author=author
+        ).delete()[0]:
+            invalidate_user_feed(request.user.id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        permission_classes=(IsAuthenticated,),
+        url_path='subscribe',
+    )
+    def subscribe_batch(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        user = request.user
+        with transaction.atomic():
+            invalidate_user_feed(user.id)
+            existing = set(
+                Subscribe.objects.filter(
+                    user=user, author_id__in=ids
+                ).values_list('author_id', flat=True)
+            )
+            if request.method == 'DELETE':
+                Subscribe.objects.filter(
+                    user=user, author_id__in=existing
+                ).delete()
+                return batch_response(ids, {'deleted': existing})
+            found = set(
+                CustomUser.objects.filter(id__in=ids)
+                .exclude(id=user.id)
+                .values_list('id', flat=True)
+            )
+            created = found - existing
+            Subscribe.objects.bulk_create(
+                [Subscribe(user=user, author_id=pk) for pk in created],
+                ignore_conflicts=True,
+            )
+        return batch_response(
+            ids, {'created': created, 'exists': existing, 'self': {user.id}}
+        )
+
     @action(
         detail=False, methods=('get',), permission_classes=(IsAuthenticated,)
     )
     def subscriptions(self, request):
-        queryset = Subscribe.objects.filter(user=request.user)
+        queryset = (
+            Subscribe.objects.filter(user=request.user)
+            .select_related('author')
+            .annotate(recipes_count=Count('author__recipe'))
+            .order_by('-id')
+        )
         page = self.paginate_queryset(queryset)
+        recipes = Recipe.objects.all()
+        recipes_limit = request.query_params.get('recipes_limit', '')
+        if recipes_limit.isdigit():
+            recipes = recipes.filter(
+                pk__in=Subquery(
+                    Recipe.objects.filter(author=OuterRef('author')).values(
+                        'pk'
+                    )[: int(recipes_limit)]
+                )
+            )
+        prefetch_related_objects(
+            [subscribe.author for subscribe in page],
+            Prefetch('recipe', queryset=recipes, to_attr='limited_recipes'),
+        )
         serializer = SubscribeSerializer(
             page, many=True, context={'request': request}
         )
         return self.get_paginated_response(serializer.data)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CachedReferenceMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет для работы с тэгами."""
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
     pagination_class = None
+    cache_prefix = 'tags'
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedReferenceMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет для работы с ингредиентами."""
 
     queryset = Ingredient.objects.all()
@@ -90,6 +199,18 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientSearchFilter
     pagination_class = None
+    cache_prefix = 'ingredients'
+
+    def list(self, request, *args, **kwargs):
+        if not settings.INGREDIENT_SEARCH_INDEX:
+            return super().list(request, *args, **kwargs)
+        limit = request.query_params.get('limit', '')
+        return Response(
+            ingredient_index.search(
+                request.query_params.get('name', ''),
+                int(limit) if limit.isdigit() and int(limit) else None,
+            )
+        )
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
@@ -97,10 +218,49 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     queryset = Recipe.objects.all()
     permission_classes = (IsAuthorOrAdminOrReadOnly,)
-    pagination_class = LimitPageNumberPagination
+    pagination_class = OptionalCursorPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeSearchFilter
 
+    def get_queryset(self):
+        if self.request.method not in SAFE_METHODS:
+            return Recipe.objects.all()
+        user = self.request.user
+        queryset = Recipe.objects.defer('search_vector').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredientrecipe_set',
+                queryset=IngredientRecipe.objects.select_related(
+                    'ingredient'
+                ).order_by('ingredient__name'),
+                to_attr='recipe_ingredients',
+            ),
+        )
+        if user.is_anonymous:
+            return queryset.select_related('author').annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+            )
+        return queryset.prefetch_related(
+            Prefetch(
+                'author',
+                queryset=CustomUser.objects.annotate(
+                    is_subscribed=Exists(
+                        Subscribe.objects.filter(
+                            user=user, author=OuterRef('pk')
+                        )
+                    )
+                ),
+            )
+        ).annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+        )
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeReadSerializer
@@ -109,17 +269,93 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    counter_fields = {
+        Favorite: 'favorites_count',
+        ShoppingCart: 'carts_count',
+    }
+
+    @transaction.atomic
     def create_instance(self, model, user, pk):
         recipe = get_object_or_404(Recipe, id=pk)
-        model.objects.create(user=user, recipe=recipe)
+        try:
+            with transaction.atomic():
+                model.objects.create(user=user, recipe=recipe)
+        except IntegrityError:
+            return Response(
+                {'errors': 'Рецепт уже добавлен!'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        invalidate_user_feed(user.id)
+        field = self.counter_fields[model]
+        Recipe.objects.filter(id=recipe.id).update(**{field: F(field) + 1})
+        if model is ShoppingCart:
+            shopping_list.add_recipes(user, [recipe.id])
         serializer = RecipeShortSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def delete_instance(self, model, user, pk):
         obj = model.objects.filter(user=user, recipe__id=pk)
-        obj.delete()
+        deleted, _ = obj.delete()
+        if deleted:
+            invalidate_user_feed(user.id)
+            field = self.counter_fields[model]
+            Recipe.objects.filter(id=pk, **{f'{field}__gt': 0}).update(
+                **{field: F(field) - 1}
+            )
+            if model is ShoppingCart:
+                shopping_list.remove_recipes(user, [pk])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @transaction.atomic
+    def create_instances(self, model, user, ids):
+        found = set(
+            Recipe.objects.filter(id__in=ids).values_list('id', flat=True)
+        )
+        existing = set(
+            model.objects.filter(user=user, recipe_id__in=found).values_list(
+                'recipe_id', flat=True
+            )
+        )
+        created = found - existing
+        invalidate_user_feed(user.id)
+        model.objects.bulk_create(
+            [model(user=user, recipe_id=pk) for pk in created],
+            ignore_conflicts=True,
+        )
+        field = self.counter_fields[model]
+        Recipe.objects.filter(id__in=created).update(**{field: F(field) + 1})
+        if model is ShoppingCart:
+            shopping_list.add_recipes(user, created)
+        return batch_response(
+            ids, {'created': created, 'exists': existing}
+        )
+
+    @transaction.atomic
+    def delete_instances(self, model, user, ids):
+        existing = set(
+            model.objects.filter(user=user, recipe_id__in=ids).values_list(
+                'recipe_id', flat=True
+            )
+        )
+        model.objects.filter(user=user, recipe_id__in=existing).delete()
+        invalidate_user_feed(user.id)
+        field = self.counter_fields[model]
+        Recipe.objects.filter(
+            id__in=existing, **{f'{field}__gt': 0}
+        ).update(**{field: F(field) - 1})
+        if model is ShoppingCart:
+            shopping_list.remove_recipes(user, existing)
+        return batch_response(ids, {'deleted': existing})
+
+    def batch(self, request, model):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        if request.method == 'POST':
+            return self.create_instances(model, request.user, ids)
+        return self.delete_instances(model, request.user, ids)
+
     @action(
         detail=True,
         methods=('post', 'delete'),
@@ -142,25 +378,136 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @action(
         detail=False,
+        methods=('post', 'delete'),
+        permission_classes=(IsAuthenticated,),
+        url_path='favorite',
+    )
+    def favorite_batch(self, request):
+        return self.batch(request, Favorite)
+
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
         permission_classes=(IsAuthenticated,),
+        url_path='shopping_cart',
     )
-    def download_shopping_cart(self, user):
-        ingredients = IngredientRecipe.objects.filter(
-            recipe__shopping_cart__user=user.user
-        )
-        compressed_ingredients = Counter()
-        for ing in ingredients:
-            compressed_ingredients[
-                (ing.ingredient.name, ing.ingredient.measurement_unit)
-            ] += ing.amount
-        shopping_list = [
-            f"- {name}: {amount} {measurement_unit}\n"
-            for (
-                name,
-                measurement_unit,
-            ), amount in compressed_ingredients.items()
+    def shopping_cart_batch(self, request):
+        return self.batch(request, ShoppingCart)
+
+    def recommendations_response(self, request, get_results):
+        limit = request.query_params.get('limit', '')
+        limit = min(int(limit), MAX_RECOMMENDATIONS) if limit.isdigit() else 6
+        results = get_results(limit)
+        recipes = Recipe.objects.in_bulk([pk for pk, _ in results])
+        return Response(
+            [
+                {
+                    **RecipeShortSerializer(recipes[pk]).data,
+                    'score': round(score, 4),
+                }
+                for pk, score in results
+                if pk in recipes
+            ]
+        )
+
+    @action(detail=True)
+    def similar(self, request, pk):
+        recipe = get_object_or_404(Recipe, id=pk)
+        return self.recommendations_response(
+            request,
+            lambda limit: recommendation_index.similar(recipe.id, limit),
+        )
+
+    @action(detail=False)
+    def with_ingredients(self, request):
+        ingredient_ids = [
+            value
+            for param in request.query_params.getlist('ingredients')
+            for value in param.split(',')
         ]
-        filename = 'shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
+        if not ingredient_ids or not all(
+            value.isdigit() for value in ingredient_ids
+        ):
+            return Response(
+                {'errors': 'Укажите id ингредиентов: ingredients=1,2,3'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return self.recommendations_response(
+            request,
+            lambda limit: recommendation_index.with_ingredients(
+                [int(value) for value in ingredient_ids], limit
+            ),
+        )
+
+    @action(
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+    )
+    def feed(self, request):
+        """
+        Рецепты авторов, на которых подписан пользователь, от новых к
+        старым с курсорной пагинацией. Первая страница кэшируется.
+        """
+        user = request.user
+        author_ids, user_version = get_followed_authors(user.id)
+        paginator = LimitCursorPagination()
+        key = None
+        if paginator.cursor_query_param not in request.query_params:
+            key = get_page_key(
+                user.id, user_version, author_ids, request.build_absolute_uri()
+            )
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+        queryset = self.get_queryset().filter(
+            author_id__in=author_ids
+        ).order_by('-pub_date', '-id')
+        page = paginator.paginate_queryset(queryset, request, self)
+        serializer = self.get_serializer(page, many=True)
+        response = paginator.get_paginated_response(serializer.data)
+        if key is not None:
+            cache.set(key, response.data, settings.FEED_CACHE_TIMEOUT)
+        return response
+
+    @action(
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+    )
+    def shopping_list(self, request):
+        items = (
+            ShoppingListItem.objects.filter(user=request.user)
+            .select_related('ingredient')
+            .order_by('ingredient__name')
+        )
+        return Response(ShoppingListItemSerializer(items, many=True).data)
+
+    @action(
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+    )
+    def download_shopping_cart(self, request):
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {
+                    'errors': 'Доступные форматы: '
+                    + ', '.join(SHOPPING_LIST_FORMATS)
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        ingredients = (
+            ShoppingListItem.objects.filter(user=request.user)
+            .values(
+                'ingredient__name',
+                'ingredient__measurement_unit',
+                total=F('amount'),
+            )
+            .order_by('ingredient__name')
+        )
+        render, content_type = SHOPPING_LIST_FORMATS[file_format]
+        filename = f'shopping_list.{file_format}'
+        response = StreamingHttpResponse(
+            render(ingredients.iterator()), content_type=content_type
+        )
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
@@ -0,0 +1,105 @@
+import json
+import logging
+import time
+
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('foodgram.profiling')
+
+
+class QueryRecorder:
+    """Обёртка execute_wrapper: считает запросы и время в БД."""
+
+    def __init__(self):
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.statements[sql] += 1
+
+
+class RequestProfilingMiddleware:
+    """
+    Замеряет для каждого запроса количество и время SQL-запросов, время
+    работы view (для DRF - в основном сериализация), время рендеринга
+    ответа и общее время. Результат отдаётся в заголовке Server-Timing и
+    пишется в лог 'foodgram.profiling' одной JSON-строкой; повторяющиеся
+    SQL-запросы (признак N+1) выводятся с уровнем WARNING.
+
+    Включается настройкой REQUEST_PROFILING, в выключенном состоянии
+    исключается из цепочки middleware при старте.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request._profiling_view_end = None
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        end = time.perf_counter()
+        view_end = request._profiling_view_end or end
+        timings = {
+            'db': recorder.duration * 1000,
+            'view': (view_end - start) * 1000,
+            'render': (end - view_end) * 1000,
+            'total': (end - start) * 1000,
+        }
+        queries = sum(recorder.statements.values())
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={duration:.2f}'
+            + (f';desc="{queries} queries"' if name == 'db' else '')
+            for name, duration in timings.items()
+        )
+        duplicates = {
+            sql: count
+            for sql, count in recorder.statements.most_common()
+            if count > 1
+        }
+        record = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'queries': queries,
+            'duplicate_queries': sum(duplicates.values()),
+            **{
+                f'{name}_ms': round(value, 2)
+                for name, value in timings.items()
+            },
+        }
+        logger.info(json.dumps(record, ensure_ascii=False))
+        if duplicates:
+            logger.warning(
+                json.dumps(
+                    {
+                        'path': record['path'],
+                        'duplicates': [
+                            {'sql': sql, 'count': count}
+                            for sql, count in list(duplicates.items())[:5]
+                        ],
+                    },
+                    ensure_ascii=False,
+                )
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # Вызывается после view и до рендеринга ответа (в том числе DRF).
+        request._profiling_view_end = time.perf_counter()
+        return response
@@ -43,8 +43,27 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'foodgram.middleware.RequestProfilingMiddleware',
 ]
 
+# Замер SQL-запросов и времени обработки запросов (заголовок Server-Timing).
+REQUEST_PROFILING = os.getenv('REQUEST_PROFILING', default='False') == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'foodgram.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 ROOT_URLCONF = 'foodgram.urls'
 
 TEMPLATES = [
@@ -83,6 +102,34 @@ DATABASES = {
 }
 
 
+# Версии кэша справочников, ленты и индексов в памяти сбрасываются через
+# кэш, поэтому при нескольких процессах (воркеры gunicorn, команды
+# manage.py) нужен общий бэкенд, например Redis; locmem виден только
+# своему процессу (см. manage.py check --deploy).
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+
+# Время жизни закэшированных ответов справочников (тэги, ингредиенты).
+REFERENCE_CACHE_TIMEOUT = int(
+    os.getenv('REFERENCE_CACHE_TIMEOUT', default=60 * 60)
+)
+
+# Время жизни закэшированных первых страниц ленты подписок и списка
+# авторов, на которых подписан пользователь.
+FEED_CACHE_TIMEOUT = int(os.getenv('FEED_CACHE_TIMEOUT', default=5 * 60))
+
+# Покрывающие индексы (Index.include) поддерживает только PostgreSQL,
+# на SQLite неключевые столбцы просто не попадают в индекс.
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -125,6 +172,10 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Проверка и сохранение изображений рецептов в фоновых потоках.
+RECIPE_IMAGE_ASYNC = os.getenv('RECIPE_IMAGE_ASYNC', default='False') == 'True'
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', default=2))
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
@@ -140,6 +191,30 @@ REST_FRAMEWORK = {
 
 CSV_FILES_DIR = os.path.join(BASE_DIR, 'data')
 
+# TTF-шрифт с кириллицей для выгрузки списка покупок в PDF.
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
+# Автодополнение ингредиентов из индекса в памяти процесса, без запросов к БД.
+# Требует общего кэша (CACHE_BACKEND, например Redis): через него процессы
+# узнают о загрузке новых ингредиентов.
+INGREDIENT_SEARCH_INDEX = (
+    os.getenv('INGREDIENT_SEARCH_INDEX', default='False') == 'True'
+)
+
+# Как часто (в секундах) индексы поиска в памяти сверяют версию с кэшем.
+SEARCH_INDEX_CHECK_INTERVAL = int(
+    os.getenv('SEARCH_INDEX_CHECK_INTERVAL', default=5)
+)
+
+# Файл индекса рекомендаций рецептов (команда build_recommendations).
+RECOMMENDATION_INDEX_PATH = os.getenv(
+    'RECOMMENDATION_INDEX_PATH',
+    default=os.path.join(BASE_DIR, 'recommendations.npz'),
+)
+
 AUTH_USER_MODEL = 'users.CustomUser'
 
 DJOSER = {
@@ -1,14 +1,17 @@
 from django.contrib import admin
 
+from . import shopping_list
 from .models import (
     Favorite,
     Ingredient,
     IngredientRecipe,
     Recipe,
     ShoppingCart,
+    ShoppingListItem,
     Subscribe,
     Tag,
 )
+from .search import search_recipes
 
 admin.site.empty_value_display = 'Значение отсутствует'
 
@@ -55,8 +58,26 @@ class RecipeAdmin(admin.ModelAdmin):
     search_fields = ('name',)
     inlines = (IngredientRecipeInline,)
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        return search_recipes(queryset, search_term), False
+
+    def save_model(self, request, obj, form, change):
+        if 'image' in form.changed_data:
+            # Новое изображение отменяет ещё не сохранённое в фоне.
+            obj.image_pending = False
+            obj.image_token = None
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        with shopping_list.track_recipes([form.instance.pk]):
+            super().save_related(request, form, formsets, change)
+
     def get_favorites(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
     get_favorites.short_description = (
         'Количество добавлений рецепта в избранное'
@@ -90,7 +111,51 @@ class IngredientRecipeAdmin(admin.ModelAdmin):
 
     list_display = ('pk', 'ingredient', 'recipe', 'amount')
 
+    def save_model(self, request, obj, form, change):
+        recipe_ids = {obj.recipe_id}
+        if change:
+            recipe_ids.update(
+                IngredientRecipe.objects.filter(pk=obj.pk).values_list(
+                    'recipe_id', flat=True
+                )
+            )
+        with shopping_list.track_recipes(recipe_ids):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with shopping_list.track_recipes([obj.recipe_id]):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        with shopping_list.track_recipes(recipe_ids):
+            super().delete_queryset(request, queryset)
+
 
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'recipe')
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            old = ShoppingCart.objects.select_related('user').get(pk=obj.pk)
+            shopping_list.remove_recipes(old.user, [old.recipe_id])
+        super().save_model(request, obj, form, change)
+        shopping_list.add_recipes(obj.user, [obj.recipe_id])
+
+    def delete_model(self, request, obj):
+        shopping_list.remove_recipes(obj.user, [obj.recipe_id])
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        for cart in queryset.select_related('user'):
+            shopping_list.remove_recipes(cart.user, [cart.recipe_id])
+        super().delete_queryset(request, queryset)
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    """Класс настройки раздела агрегированных списков покупок"""
+
+    list_display = ('pk', 'user', 'ingredient', 'amount')
+    list_filter = ('user',)
@@ -1,5 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class RecipesConfig(AppConfig):
     name = 'recipes'
+
+    def ready(self):
+        from .search import check_ingredient_index_cache
+        from .signals import create_postgres_indexes
+
+        check_ingredient_index_cache()
+        post_migrate.connect(create_postgres_indexes, sender=self)
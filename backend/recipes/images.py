@@ -0,0 +1,193 @@
+import base64
+import logging
+import os
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Поле модели с уменьшенной копией -> максимальная сторона в пикселях.
+IMAGE_VARIANTS = {
+    'image_small': 240,
+    'image_medium': 720,
+}
+
+
+# Размер порции base64 при декодировании, кратен 4.
+BASE64_CHUNK_SIZE = 64 * 1024
+IMAGE_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif'}
+
+_executor = None
+
+
+class PendingImage:
+    """
+    Проверенное, но ещё не декодированное и не сохранённое изображение.
+    Хранит исходную строку base64, поэтому при ошибке валидации или откате
+    транзакции на диске ничего не остаётся. Токен записывается в рецепт
+    (image_token) и позволяет не сохранить изображение, если рецепт уже
+    получил более новое.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.token = uuid4()
+
+
+def iter_base64_chunks(data):
+    if ';base64,' in data:
+        data = data.split(';base64,', 1)[1]
+    for start in range(0, len(data), BASE64_CHUNK_SIZE):
+        yield base64.b64decode(
+            data[start:start + BASE64_CHUNK_SIZE], validate=True
+        )
+
+
+def validate_base64_image(data):
+    """
+    Проверяет base64 порциями, не создавая в памяти полную копию
+    изображения и ничего не записывая на диск. Формат проверяется по
+    заголовку, полная проверка выполняется фоновым обработчиком.
+    """
+    for number, chunk in enumerate(iter_base64_chunks(data)):
+        if not number:
+            with Image.open(BytesIO(chunk)) as image:
+                if image.format not in IMAGE_FORMATS:
+                    raise ValueError(image.format)
+    return PendingImage(data)
+
+
+def store_pending_image(recipe_id, pending_image):
+    """
+    Декодирует, проверяет и сохраняет изображение в рецепт вне запроса.
+    Задачи выполняются в произвольном порядке, поэтому изображение
+    сохраняется, только если токен рецепта не сменился.
+    """
+    from .models import Recipe
+
+    close_old_connections()
+    current = Recipe.objects.filter(
+        pk=recipe_id, image_token=pending_image.token
+    )
+    try:
+        if not current.exists():
+            return
+        with tempfile.TemporaryFile(prefix='recipe-image-') as file:
+            for chunk in iter_base64_chunks(pending_image.data):
+                file.write(chunk)
+            file.seek(0)
+            with Image.open(file) as image:
+                image.verify()
+                extension = IMAGE_FORMATS[image.format]
+            file.seek(0)
+            name = f'{uuid4()}.{extension}'
+            field = Recipe._meta.get_field('image')
+            name = field.storage.save(
+                field.generate_filename(None, name), File(file, name)
+            )
+        with transaction.atomic():
+            recipe = current.select_for_update().first()
+            if recipe is None:
+                return
+            recipe.image = name
+            recipe.image_pending = False
+            recipe.image_token = None
+            recipe.save(
+                update_fields=('image', 'image_pending', 'image_token')
+            )
+    except Exception:
+        logger.exception(
+            'Не удалось сохранить изображение рецепта %s', recipe_id
+        )
+        current.update(image_pending=False, image_token=None)
+    finally:
+        close_old_connections()
+
+
+def submit_pending_image(recipe_id, pending_image):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.RECIPE_IMAGE_WORKERS,
+            thread_name_prefix='recipe-image',
+        )
+    _executor.submit(store_pending_image, recipe_id, pending_image)
+
+
+def flatten(image):
+    """
+    Переводит изображение в RGB. В JPEG нет прозрачности, поэтому
+    прозрачные пиксели накладываются на белый фон, а не становятся чёрными.
+    """
+    if image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    ):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def make_variant(image_file, size):
+    """Уменьшает изображение и пережимает его в progressive JPEG."""
+    image_file.seek(0)
+    with Image.open(image_file) as image:
+        image = flatten(ImageOps.exif_transpose(image))
+        image.thumbnail((size, size))
+        buffer = BytesIO()
+        image.save(
+            buffer, 'JPEG', quality=80, optimize=True, progressive=True
+        )
+    return ContentFile(buffer.getvalue())
+
+
+def variants_outdated(recipe):
+    if not recipe.image:
+        return any(getattr(recipe, field) for field in IMAGE_VARIANTS)
+    base = os.path.splitext(os.path.basename(recipe.image.name))[0]
+    return any(
+        not getattr(recipe, field)
+        or not os.path.basename(getattr(recipe, field).name).startswith(base)
+        for field in IMAGE_VARIANTS
+    )
+
+
+def update_image_variants(recipe):
+    """
+    Создаёт уменьшенные копии изображения рецепта, если изображение
+    сменилось, и сохраняет их имена без повторного вызова save().
+    """
+    if not variants_outdated(recipe):
+        return
+    updates = {}
+    if recipe.image:
+        base = os.path.splitext(os.path.basename(recipe.image.name))[0]
+        with recipe.image.open('rb') as image_file:
+            for field, size in IMAGE_VARIANTS.items():
+                variant = getattr(recipe, field)
+                # Имя оригинала - хэш содержимого, поэтому уже созданную
+                # копию того же изображения можно использовать повторно.
+                filename = f'{base}_{size}.jpg'
+                name = variant.field.generate_filename(recipe, filename)
+                if variant.storage.exists(name):
+                    variant.name = name
+                else:
+                    variant.save(
+                        filename, make_variant(image_file, size), save=False
+                    )
+                updates[field] = variant.name
+    else:
+        for field in IMAGE_VARIANTS:
+            setattr(recipe, field, None)
+            updates[field] = None
+    type(recipe).objects.filter(pk=recipe.pk).update(**updates)
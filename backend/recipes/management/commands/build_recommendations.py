@@ -0,0 +1,46 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.recommendations import RecommendationIndex
+
+
+class Command(BaseCommand):
+    help = (
+        'Сборка индекса рекомендаций рецептов по ингредиентам. Работающие '
+        'процессы перечитывают индекс после замены файла'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help=(
+                'Добавить новые и убрать удалённые рецепты из существующего '
+                'индекса вместо полной сборки'
+            ),
+        )
+        parser.add_argument(
+            '--path', help='Путь к файлу индекса вместо настройки проекта'
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        index = RecommendationIndex(options['path'])
+        if options['incremental'] and os.path.exists(index.get_path()):
+            index.load()
+            added, removed = index.update()
+            message = f'Добавлено рецептов: {added}, удалено: {removed}'
+        else:
+            recipes, links = index.rebuild()
+            message = (
+                f'Рецептов в индексе: {recipes}, '
+                f'связей с ингредиентами: {links}'
+            )
+        index.save()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{message} за {time.monotonic() - start:.1f} с'
+            )
+        )
@@ -0,0 +1,85 @@
+import posixpath
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from recipes.images import IMAGE_VARIANTS
+from recipes.models import Recipe
+
+IMAGE_FIELDS = ('image', *IMAGE_VARIANTS)
+
+
+def walk(storage, path):
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield posixpath.join(path, name)
+    for directory in directories:
+        yield from walk(storage, posixpath.join(path, directory))
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаление файлов изображений, на которые не ссылается ни один рецепт'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=60 * 60,
+            help='Не трогать файлы моложе указанного числа секунд',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только вывести количество неиспользуемых файлов',
+        )
+
+    def handle(self, *args, **options):
+        field = Recipe._meta.get_field('image')
+        storage = field.storage
+        root = field.upload_to.rstrip('/')
+        if not storage.exists(root):
+            return
+        threshold = timezone.now() - timedelta(seconds=options['min_age'])
+        checked = removed = 0
+        batch = []
+        for name in walk(storage, root):
+            batch.append(name)
+            if len(batch) >= options['batch_size']:
+                removed += self.clean_batch(storage, batch, threshold, options)
+                checked += len(batch)
+                batch = []
+        if batch:
+            removed += self.clean_batch(storage, batch, threshold, options)
+            checked += len(batch)
+        action = 'Найдено неиспользуемых' if options['dry_run'] else 'Удалено'
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Проверено файлов: {checked}. {action}: {removed}'
+            )
+        )
+
+    def clean_batch(self, storage, batch, threshold, options):
+        condition = Q()
+        for field in IMAGE_FIELDS:
+            condition |= Q(**{f'{field}__in': batch})
+        referenced = set()
+        for names in Recipe.objects.filter(condition).values_list(
+            *IMAGE_FIELDS
+        ):
+            referenced.update(names)
+        orphans = [
+            name
+            for name in batch
+            if name not in referenced
+            and storage.get_modified_time(name) < threshold
+        ]
+        if not options['dry_run']:
+            for name in orphans:
+                storage.delete(name)
+        return len(orphans)
@@ -0,0 +1,308 @@
+import random
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import django
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections
+from django.db.models import Max
+from django.utils import timezone
+
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    Subscribe,
+    Tag,
+)
+from recipes.search import recipe_search_index
+
+User = get_user_model()
+
+DEFAULT_TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+
+
+def power_law(rng, size, alpha):
+    """
+    Случайный номер от 0 до size - 1 с вероятностью, убывающей как
+    номер ** -alpha: малые номера (популярные авторы и рецепты) выпадают
+    намного чаще остальных.
+    """
+    uniform = rng.random()
+    if alpha == 1:
+        value = (size + 1) ** uniform
+    else:
+        value = (
+            ((size + 1) ** (1 - alpha) - 1) * uniform + 1
+        ) ** (1 / (1 - alpha))
+    return min(int(value) - 1, size - 1)
+
+
+def generate_recipes(task):
+    rng = random.Random(task['seed'])
+    pub_date = Recipe._meta.get_field('pub_date')
+    # auto_now_add перезаписал бы даты публикации, а для проверки планов
+    # запросов они должны быть распределены во времени.
+    pub_date.auto_now_add = False
+    try:
+        recipe_ids = range(task['start'], task['start'] + task['count'])
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    id=recipe_id,
+                    author_id=task['user_start']
+                    + power_law(rng, task['users'], task['alpha']),
+                    name=f'Рецепт {recipe_id}',
+                    text='Сгенерированный рецепт',
+                    cooking_time=rng.randint(5, 180),
+                    pub_date=task['now']
+                    - timedelta(seconds=rng.randint(0, task['period'])),
+                )
+                for recipe_id in recipe_ids
+            ),
+            batch_size=task['batch_size'],
+        )
+    finally:
+        pub_date.auto_now_add = True
+    ingredient_ids = task['ingredient_ids']
+    IngredientRecipe.objects.bulk_create(
+        (
+            IngredientRecipe(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=rng.randint(1, 500),
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in rng.sample(
+                ingredient_ids, rng.randint(3, 15)
+            )
+        ),
+        batch_size=task['batch_size'],
+    )
+    Recipe.tags.through.objects.bulk_create(
+        (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in rng.sample(
+                task['tag_ids'], rng.randint(1, len(task['tag_ids']))
+            )
+        ),
+        batch_size=task['batch_size'],
+    )
+    return task['count']
+
+
+def sample_targets(rng, start, size, count, alpha):
+    return {start + power_law(rng, size, alpha) for _ in range(count)}
+
+
+def generate_relations(task):
+    rng = random.Random(task['seed'])
+    user_ids = range(task['start'], task['start'] + task['count'])
+    relations = (
+        (Favorite, 'recipe_id', task['favorites']),
+        (ShoppingCart, 'recipe_id', task['carts']),
+    )
+    for model, field, mean in relations:
+        model.objects.bulk_create(
+            (
+                model(user_id=user_id, **{field: target})
+                for user_id in user_ids
+                for target in sample_targets(
+                    rng,
+                    task['recipe_start'],
+                    task['recipes'],
+                    rng.randint(0, 2 * mean),
+                    task['alpha'],
+                )
+            ),
+            batch_size=task['batch_size'],
+            ignore_conflicts=True,
+        )
+    Subscribe.objects.bulk_create(
+        (
+            Subscribe(user_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in sample_targets(
+                rng,
+                task['user_start'],
+                task['users'],
+                rng.randint(0, 2 * task['subscriptions']),
+                task['alpha'],
+            )
+            if author_id != user_id
+        ),
+        batch_size=task['batch_size'],
+        ignore_conflicts=True,
+    )
+    return task['count']
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерация синтетических пользователей, рецептов, избранного, '
+        'списков покупок и подписок со степенным распределением '
+        'популярности для оценки нагрузки на базу данных'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=10000,
+        )
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=100000,
+        )
+        parser.add_argument(
+            '--favorites',
+            type=int,
+            default=20,
+            help='Среднее число рецептов в избранном у пользователя',
+        )
+        parser.add_argument(
+            '--carts',
+            type=int,
+            default=5,
+            help='Среднее число рецептов в списке покупок у пользователя',
+        )
+        parser.add_argument(
+            '--subscriptions',
+            type=int,
+            default=10,
+            help='Среднее число подписок у пользователя',
+        )
+        parser.add_argument(
+            '--alpha',
+            type=float,
+            default=1.2,
+            help='Показатель степенного распределения популярности',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Количество процессов (для SQLite используйте 1)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+        )
+
+    def handle(self, *args, **options):
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        if not ingredient_ids:
+            raise CommandError('Сначала загрузите ингредиенты: load_data')
+        if not Tag.objects.exists():
+            Tag.objects.bulk_create(
+                Tag(name=name, color=color, slug=slug)
+                for name, color, slug in DEFAULT_TAGS
+            )
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        batch_size = options['batch_size']
+        start = time.monotonic()
+
+        user_start = self.next_id(User)
+        User.objects.bulk_create(
+            (
+                User(
+                    id=user_id,
+                    email=f'user{user_id}@example.com',
+                    username=f'user{user_id}',
+                    first_name='Имя',
+                    last_name='Фамилия',
+                    password='!',
+                )
+                for user_id in range(user_start, user_start + options['users'])
+            ),
+            batch_size=batch_size,
+        )
+        recipe_start = self.next_id(Recipe)
+        common = {
+            'alpha': options['alpha'],
+            'batch_size': batch_size,
+            'user_start': user_start,
+            'users': options['users'],
+            'recipe_start': recipe_start,
+            'recipes': options['recipes'],
+        }
+        recipe_tasks = [
+            {
+                **common,
+                'seed': f'{options["seed"]}:recipes:{offset}',
+                'start': recipe_start + offset,
+                'count': min(batch_size, options['recipes'] - offset),
+                'ingredient_ids': ingredient_ids,
+                'tag_ids': tag_ids,
+                'now': timezone.now(),
+                'period': 365 * 24 * 60 * 60,
+            }
+            for offset in range(0, options['recipes'], batch_size)
+        ]
+        self.run(generate_recipes, recipe_tasks, options['workers'])
+        relation_tasks = [
+            {
+                **common,
+                'seed': f'{options["seed"]}:relations:{offset}',
+                'start': user_start + offset,
+                'count': min(batch_size, options['users'] - offset),
+                'favorites': options['favorites'],
+                'carts': options['carts'],
+                'subscriptions': options['subscriptions'],
+            }
+            for offset in range(0, options['users'], batch_size)
+        ]
+        self.run(generate_relations, relation_tasks, options['workers'])
+        self.reset_sequences()
+        call_command('reconcile_counters', batch_size=batch_size)
+        call_command('rebuild_shopping_lists')
+        recipe_search_index.invalidate()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Создано пользователей: {options["users"]}, '
+                f'рецептов: {options["recipes"]} '
+                f'за {time.monotonic() - start:.1f} с'
+            )
+        )
+
+    def next_id(self, model):
+        return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+    def run(self, function, tasks, workers):
+        if workers <= 1:
+            for task in tasks:
+                function(task)
+            return
+        # Дочерние процессы должны открыть собственные соединения с БД.
+        connections.close_all()
+        with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+            for _ in pool.map(function, tasks):
+                pass
+
+    def reset_sequences(self):
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [User, Recipe]
+        )
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
@@ -1,25 +1,129 @@
 import csv
+import io
+import json
+import time
 
-from django.core.management.base import BaseCommand
+from itertools import islice
+
+from api.cache import invalidate_reference_cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 from foodgram.settings import CSV_FILES_DIR
 
 from recipes.models import Ingredient
+from recipes.search import ingredient_index
+
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def iter_csv(file):
+    for row in csv.reader(file):
+        if not row or row == ['name', 'measurement_unit']:
+            continue
+        yield row[0], row[1]
+
+
+def iter_json(file):
+    """Построчно читает объекты из JSON-массива, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(JSON_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидался JSON-массив ингредиентов')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(JSON_CHUNK_SIZE)
+            if not chunk:
+                raise CommandError('Некорректный JSON-файл')
+            buffer += chunk
+            continue
+        yield item['name'], item['measurement_unit']
+        buffer = buffer[end:]
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
 
 
 class Command(BaseCommand):
     help = 'Загрузка ингредиентов в базу данных'
 
-    def handle(self, *args, **kwargs):
-        with open(
-            f'{CSV_FILES_DIR}/ingredients.csv', encoding='utf-8'
-        ) as file:
-            reader = csv.reader(file)
-            next(reader)
-            ingredients = [
-                Ingredient(
-                    name=row[0],
-                    measurement_unit=row[1],
-                )
-                for row in reader
-            ]
-            Ingredient.objects.bulk_create(ingredients)
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            default=f'{CSV_FILES_DIR}/ingredients.csv',
+            help='CSV (name,measurement_unit) или JSON-массив ингредиентов',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Загружать через COPY (только PostgreSQL)',
+        )
+
+    def handle(self, *args, **options):
+        use_copy = options['copy']
+        if use_copy and connection.vendor != 'postgresql':
+            self.stderr.write('COPY доступен только в PostgreSQL')
+            use_copy = False
+        insert = self.insert_copy if use_copy else self.insert_bulk
+        reader = iter_json if options['file'].endswith('.json') else iter_csv
+        before = Ingredient.objects.count()
+        processed = 0
+        start = time.monotonic()
+        with open(options['file'], encoding='utf-8') as file:
+            for batch in batches(reader(file), options['batch_size']):
+                insert(batch)
+                processed += len(batch)
+        elapsed = time.monotonic() - start
+        ingredient_index.invalidate()
+        invalidate_reference_cache('ingredients')
+        added = Ingredient.objects.count() - before
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Обработано строк: {processed}, добавлено: {added}, '
+                f'{processed / max(elapsed, 1e-6):.0f} строк/с'
+            )
+        )
+
+    def insert_bulk(self, batch):
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in batch
+            ),
+            ignore_conflicts=True,
+        )
+
+    def insert_copy(self, batch):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        table = Ingredient._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_import '
+                '(name varchar(250), measurement_unit varchar(250)) '
+                'ON COMMIT DROP'
+            )
+            cursor.copy_expert(
+                'COPY ingredient_import (name, measurement_unit) '
+                'FROM STDIN WITH CSV',
+                buffer,
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit '
+                'FROM ingredient_import '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import shopping_list
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересборка агрегированных списков покупок пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Количество пользователей, обрабатываемых за раз',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        rebuilt = 0
+        while True:
+            user_ids = list(
+                User.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+            with transaction.atomic():
+                shopping_list.rebuild(user_ids)
+            rebuilt += len(user_ids)
+            last_id = user_ids[-1]
+        self.stdout.write(
+            self.style.SUCCESS(f'Пересобрано списков покупок: {rebuilt}')
+        )
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+
+
+def count_subquery(model):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(recipe=OuterRef('pk'))
+            .order_by()
+            .values('recipe')
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт счётчиков избранного и списков покупок у рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество рецептов, обрабатываемых за один запрос',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        checked = fixed = 0
+        while True:
+            recipes = list(
+                Recipe.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .only('id', 'favorites_count', 'carts_count')
+                .annotate(
+                    actual_favorites=count_subquery(Favorite),
+                    actual_carts=count_subquery(ShoppingCart),
+                )[:batch_size]
+            )
+            if not recipes:
+                break
+            drifted = []
+            for recipe in recipes:
+                if (
+                    recipe.favorites_count != recipe.actual_favorites
+                    or recipe.carts_count != recipe.actual_carts
+                ):
+                    recipe.favorites_count = recipe.actual_favorites
+                    recipe.carts_count = recipe.actual_carts
+                    drifted.append(recipe)
+            Recipe.objects.bulk_update(
+                drifted, ('favorites_count', 'carts_count')
+            )
+            checked += len(recipes)
+            fixed += len(drifted)
+            last_id = recipes[-1].id
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Проверено рецептов: {checked}, исправлено: {fixed}'
+            )
+        )
@@ -1,7 +1,10 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core import validators
 from django.db import models
 
+from .storage import ContentAddressedStorage
+
 User = get_user_model()
 
 
@@ -52,7 +55,34 @@ class Recipe(models.Model):
     )
     name = models.CharField('Название рецепта', max_length=255)
     image = models.ImageField(
-        'Изображение', upload_to='static/recipe/', null=True, default=None
+        'Изображение',
+        upload_to='static/recipe/',
+        storage=ContentAddressedStorage(),
+        null=True,
+        default=None,
+    )
+    image_small = models.ImageField(
+        'Превью изображения',
+        upload_to='static/recipe/small/',
+        null=True,
+        default=None,
+        editable=False,
+    )
+    image_medium = models.ImageField(
+        'Уменьшенное изображение',
+        upload_to='static/recipe/medium/',
+        null=True,
+        default=None,
+        editable=False,
+    )
+    image_pending = models.BooleanField(
+        'Изображение обрабатывается', default=False, editable=False
+    )
+    image_token = models.UUIDField(
+        'Токен обработки изображения',
+        null=True,
+        default=None,
+        editable=False,
     )
     text = models.TextField('Описание')
     ingredients = models.ManyToManyField(
@@ -72,11 +102,33 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         auto_now_add=True, verbose_name='Дата публикации'
     )
+    favorites_count = models.PositiveIntegerField(
+        'Количество добавлений в избранное', default=0, editable=False
+    )
+    carts_count = models.PositiveIntegerField(
+        'Количество добавлений в список покупок', default=0, editable=False
+    )
+    # Заполняется триггером PostgreSQL (см. recipes.signals).
+    search_vector = SearchVectorField(
+        'Поисковый вектор', null=True, editable=False
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=('-favorites_count', '-pub_date'),
+                name='recipe_popular_idx',
+            ),
+            models.Index(
+                fields=('-pub_date', '-id'), name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=('author', '-pub_date'), name='recipe_author_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.name} от {self.author.username}'
@@ -110,6 +162,13 @@ class IngredientRecipe(models.Model):
                 fields=['recipe', 'ingredient'], name='ingredient_unique '
             )
         ]
+        indexes = [
+            models.Index(
+                fields=('recipe', 'ingredient'),
+                include=('amount',),
+                name='ingredientrecipe_cover_idx',
+            ),
+        ]
 
 
 class Favorite(models.Model):
@@ -167,6 +226,9 @@ class Subscribe(models.Model):
                 fields=['user', 'author'], name='subscribe_unique'
             )
         ]
+        indexes = [
+            models.Index(fields=('user', '-id'), name='subscribe_user_id_idx'),
+        ]
 
 
 class ShoppingCart(models.Model):
@@ -186,3 +248,35 @@ class ShoppingCart(models.Model):
                 fields=['recipe', 'user'], name='recipe_cart_unique'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=('user', 'recipe'), name='shoppingcart_user_recipe_idx'
+            ),
+        ]
+
+
+class ShoppingListItem(models.Model):
+    """
+    Модель для агрегированного списка покупок: суммарное количество
+    ингредиента по всем рецептам из списка покупок пользователя.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient, on_delete=models.CASCADE, verbose_name='Ингредиент'
+    )
+    amount = models.IntegerField('Количество', default=0)
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списка покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'], name='shopping_list_unique'
+            )
+        ]
@@ -0,0 +1,232 @@
+import heapq
+import re
+import threading
+import time
+
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from math import log
+from operator import itemgetter
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import Case, F, FloatField, Value, When
+
+from .models import Ingredient, Recipe
+
+INGREDIENT_INDEX_VERSION_KEY = 'ingredient_index_version'
+RECIPE_INDEX_VERSION_KEY = 'recipe_search_index_version'
+
+# Бэкенды кэша, данные которых видны только текущему процессу.
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Конфигурация полнотекстового поиска PostgreSQL, соответствует LANGUAGE_CODE.
+SEARCH_CONFIG = 'russian'
+# Веса совпадений в названии и описании, как веса A и B в ts_rank.
+RECIPE_SEARCH_WEIGHTS = (('name', 1.0), ('text', 0.4))
+
+
+class VersionedIndex:
+    """
+    Индекс в памяти процесса, который перестраивается при смене версии.
+    Версия хранится в кэше, поэтому сброс из одного процесса (сигнал,
+    команда загрузки) приводит к перестроению и в остальных, если кэш
+    общий. Версия сверяется не чаще раза в SEARCH_INDEX_CHECK_INTERVAL
+    секунд, сброс в своём процессе действует сразу.
+    """
+
+    version_key = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, 1, None)
+        self._version = None
+
+    def build(self):
+        raise NotImplementedError
+
+    def ensure_built(self):
+        now = time.monotonic()
+        if (
+            self._version is not None
+            and now - self._checked_at < settings.SEARCH_INDEX_CHECK_INTERVAL
+        ):
+            return
+        version = cache.get_or_set(self.version_key, 0, None)
+        if version == self._version:
+            self._checked_at = now
+            return
+        with self._lock:
+            if version != self._version:
+                self.build()
+                self._checked_at = now
+                self._version = version
+
+
+class IngredientIndex(VersionedIndex):
+    """
+    Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Названия хранятся в отсортированном массиве в casefold-виде: совпадения
+    по началу названия находятся бинарным поиском, по вхождению - проходом
+    по массиву.
+    """
+
+    version_key = INGREDIENT_INDEX_VERSION_KEY
+
+    def __init__(self):
+        super().__init__()
+        self._keys = []
+        self._items = []
+
+    def build(self):
+        ingredients = sorted(
+            (name.casefold(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'pk', 'name', 'measurement_unit'
+            )
+        )
+        self._keys = [key for key, *_ in ingredients]
+        self._items = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, pk, name, measurement_unit in ingredients
+        ]
+
+    def search(self, query, limit=None):
+        """Сначала совпадения по началу названия, затем по вхождению."""
+        self.ensure_built()
+        keys, items = self._keys, self._items
+        query = query.casefold()
+        start = end = bisect_left(keys, query)
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+        result = items[start:end]
+        if limit is not None and len(result) >= limit:
+            return result[:limit]
+        if query:
+            result += [
+                item
+                for key, item in zip(keys, items)
+                if query in key and not key.startswith(query)
+            ]
+        return result[:limit]
+
+
+def check_ingredient_index_cache():
+    """
+    Индекс ингредиентов сбрасывается из других процессов (load_data) через
+    версию в кэше, поэтому с кэшем одного процесса он устаревал бы до
+    перезапуска сервера.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.INGREDIENT_SEARCH_INDEX and backend in PROCESS_LOCAL_CACHES:
+        raise ImproperlyConfigured(
+            'INGREDIENT_SEARCH_INDEX требует общего для всех процессов '
+            f'кэша (CACHE_BACKEND), а не {backend}.'
+        )
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text.casefold())
+
+
+class RecipeSearchIndex(VersionedIndex):
+    """
+    Обратный индекс рецептов в памяти процесса для баз без полнотекстового
+    поиска (SQLite).
+
+    Слова запроса сопоставляются с началом слов рецепта, чтобы находились
+    другие словоформы ("суп" - "супы"), и рецепт должен содержать все слова
+    запроса. Релевантность - сумма весов совпадений (название весит больше
+    описания), умноженных на редкость слова.
+    """
+
+    version_key = RECIPE_INDEX_VERSION_KEY
+
+    def __init__(self):
+        super().__init__()
+        self._state = ([], [], 0)
+
+    def build(self):
+        postings = defaultdict(Counter)
+        count = 0
+        recipes = Recipe.objects.values_list(
+            'pk', *(field for field, _ in RECIPE_SEARCH_WEIGHTS)
+        )
+        for pk, *values in recipes.iterator():
+            count += 1
+            for value, (_, weight) in zip(values, RECIPE_SEARCH_WEIGHTS):
+                for term in tokenize(value):
+                    postings[term][pk] += weight
+        terms = sorted(postings)
+        self._state = (terms, [postings[term] for term in terms], count)
+
+    def search(self, query, limit=None):
+        """Возвращает [(id рецепта, релевантность), ...] по убыванию."""
+        self.ensure_built()
+        terms, postings, count = self._state
+        scores = None
+        for word in set(tokenize(query)):
+            matches = Counter()
+            start = end = bisect_left(terms, word)
+            while end < len(terms) and terms[end].startswith(word):
+                end += 1
+            for posting in postings[start:end]:
+                idf = log(1 + count / len(posting))
+                for pk, weight in posting.items():
+                    matches[pk] += weight * idf
+            if scores is not None:
+                matches = {
+                    pk: score + matches[pk]
+                    for pk, score in scores.items()
+                    if pk in matches
+                }
+            scores = matches
+            if not scores:
+                return []
+        if scores is None:
+            return []
+        if limit is None:
+            return sorted(scores.items(), key=itemgetter(1), reverse=True)
+        return heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+
+
+def search_recipes(queryset, query):
+    """
+    Полнотекстовый поиск рецептов по названию и описанию с сортировкой по
+    релевантности (аннотация rank). В PostgreSQL используется индексируемое
+    поле search_vector, в остальных базах - индекс в памяти процесса. В обоих
+    случаях возвращаются все совпадения, ограничения применяет пагинация.
+    """
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        rank = SearchRank(F('search_vector'), search_query)
+        queryset = queryset.filter(search_vector=search_query)
+    else:
+        ranked = recipe_search_index.search(query)
+        rank = Case(
+            *(When(pk=pk, then=Value(score)) for pk, score in ranked),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+        queryset = queryset.filter(pk__in=[pk for pk, _ in ranked])
+    return queryset.annotate(rank=rank).order_by('-rank', '-pub_date', '-id')
+
+
+ingredient_index = IngredientIndex()
+recipe_search_index = RecipeSearchIndex()
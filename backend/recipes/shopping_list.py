@@ -0,0 +1,135 @@
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from .models import (
+    Ingredient,
+    IngredientRecipe,
+    ShoppingCart,
+    ShoppingListItem,
+    User,
+)
+
+
+def recipe_amounts(recipe_ids):
+    """Суммарное количество каждого ингредиента в указанных рецептах."""
+    return Counter(
+        dict(
+            IngredientRecipe.objects.filter(recipe_id__in=recipe_ids)
+            .order_by()
+            .values('ingredient')
+            .annotate(total=Sum('amount'))
+            .values_list('ingredient', 'total')
+        )
+    )
+
+
+def insert_missing(users, ingredient_ids):
+    """
+    Одним INSERT ... SELECT создаёт нулевые позиции для пар пользователь -
+    ингредиент, которых ещё нет в списках покупок.
+    """
+    quote = connection.ops.quote_name
+    users_sql, users_params = users.query.sql_with_params()
+    placeholders = ', '.join(['%s'] * len(ingredient_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(ShoppingListItem._meta.db_table)} '
+            '(user_id, ingredient_id, amount) '
+            f'SELECT u.id, i.id, 0 FROM {quote(User._meta.db_table)} u, '
+            f'{quote(Ingredient._meta.db_table)} i '
+            f'WHERE u.id IN ({users_sql}) AND i.id IN ({placeholders}) '
+            'ON CONFLICT DO NOTHING',
+            (*users_params, *ingredient_ids),
+        )
+
+
+def apply_deltas(users, deltas):
+    """
+    Изменяет количества ингредиентов в списках покупок пользователей на
+    указанные величины; позиции с нулевым количеством удаляются.
+
+    users - подзапрос с id пользователей (values()). Изменение выполняется
+    тремя запросами независимо от числа пользователей и ингредиентов.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    added = [pk for pk, delta in deltas.items() if delta > 0]
+    if added:
+        insert_missing(users, added)
+    items = ShoppingListItem.objects.filter(
+        user_id__in=users, ingredient_id__in=deltas
+    )
+    items.update(
+        amount=F('amount')
+        + Case(
+            *(
+                When(ingredient_id=pk, then=Value(delta))
+                for pk, delta in deltas.items()
+            ),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    )
+    items.filter(amount__lte=0).delete()
+
+
+def add_recipes(user, recipe_ids):
+    apply_deltas(
+        User.objects.filter(pk=user.pk).values('pk'),
+        recipe_amounts(recipe_ids),
+    )
+
+
+def remove_recipes(user, recipe_ids):
+    apply_deltas(
+        User.objects.filter(pk=user.pk).values('pk'),
+        {pk: -amount for pk, amount in recipe_amounts(recipe_ids).items()},
+    )
+
+
+def change_recipe(recipe, deltas):
+    """Переносит изменение ингредиентов рецепта в списки покупок."""
+    apply_deltas(
+        ShoppingCart.objects.filter(recipe=recipe).values('user_id'), deltas
+    )
+
+
+@contextmanager
+def track_recipes(recipe_ids):
+    """
+    Переносит в списки покупок изменения ингредиентов рецептов, сделанные
+    внутри блока в обход явных дельт (например, в админке).
+    """
+    before = {pk: recipe_amounts([pk]) for pk in set(recipe_ids)}
+    yield
+    for pk, amounts in before.items():
+        after = recipe_amounts([pk])
+        change_recipe(
+            pk,
+            {
+                ingredient_id: after[ingredient_id] - amounts[ingredient_id]
+                for ingredient_id in amounts.keys() | after.keys()
+            },
+        )
+
+
+def rebuild(user_ids):
+    """Пересобирает списки покупок пользователей с нуля."""
+    ShoppingListItem.objects.filter(user_id__in=user_ids).delete()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=row['recipe__shopping_cart__user'],
+            ingredient_id=row['ingredient'],
+            amount=row['total'],
+        )
+        for row in IngredientRecipe.objects.filter(
+            recipe__shopping_cart__user__in=user_ids
+        )
+        .order_by()
+        .values('recipe__shopping_cart__user', 'ingredient')
+        .annotate(total=Sum('amount'))
+    )
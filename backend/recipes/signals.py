@@ -0,0 +1,86 @@
+import logging
+
+from django.db import DatabaseError, connections, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import shopping_list
+from .images import update_image_variants
+from .models import Ingredient, Recipe
+from .search import SEARCH_CONFIG, ingredient_index, recipe_search_index
+
+logger = logging.getLogger(__name__)
+
+POSTGRES_INDEXES = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm '
+    'ON recipes_ingredient USING gin (UPPER(name::text) gin_trgm_ops)',
+    # Поисковый вектор рецепта пересчитывается триггером при изменении
+    # названия или описания, в том числе при bulk_create и update().
+    f'''CREATE OR REPLACE FUNCTION recipes_recipe_search_vector_update()
+    RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}', NEW.name), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', NEW.text), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql''',
+    'DROP TRIGGER IF EXISTS recipes_recipe_search_vector ON recipes_recipe',
+    'CREATE TRIGGER recipes_recipe_search_vector '
+    'BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe '
+    'FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_vector_update()',
+    'UPDATE recipes_recipe SET name = name WHERE search_vector IS NULL',
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_gin '
+    'ON recipes_recipe USING gin (search_vector)',
+)
+
+
+def create_postgres_indexes(sender, using='default', **kwargs):
+    """
+    Создаёт индексы, которые нельзя описать переносимо в Meta.indexes:
+    триграммный индекс для поиска ингредиентов по вхождению и GIN-индекс
+    полнотекстового поиска рецептов вместе с обновляющим его триггером.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for sql in POSTGRES_INDEXES:
+            try:
+                with transaction.atomic(using=using):
+                    cursor.execute(sql)
+            except DatabaseError as error:
+                logger.warning('Не удалось выполнить %s: %s', sql, error)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_search_index(sender, **kwargs):
+    recipe_search_index.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+def create_image_variants(sender, instance, **kwargs):
+    update_image_variants(instance)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_from_shopping_lists(sender, instance, **kwargs):
+    # Строки ShoppingCart удалятся каскадом, поэтому количества вычитаются
+    # из списков покупок, пока ингредиенты рецепта ещё есть в базе.
+    shopping_list.change_recipe(
+        instance,
+        {
+            pk: -amount
+            for pk, amount in shopping_list.recipe_amounts(
+                [instance.pk]
+            ).items()
+        },
+    )
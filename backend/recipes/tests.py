@@ -0,0 +1,255 @@
+import tempfile
+
+from io import BytesIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from . import shopping_list
+from .images import make_variant
+from .search import (
+    VersionedIndex,
+    check_ingredient_index_cache,
+    recipe_search_index,
+    search_recipes,
+)
+from .models import (
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    ShoppingListItem,
+    Tag,
+)
+from users.models import CustomUser
+
+
+def make_png(size=(100, 100), mode='RGB', color=(200, 10, 10)):
+    buffer = BytesIO()
+    Image.new(mode, size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def make_upload():
+    return SimpleUploadedFile('image.png', make_png(), 'image/png')
+
+
+class ImageVariantTest(TestCase):
+    def assert_white_variant(self, image):
+        with Image.open(make_variant(BytesIO(image), 240)) as variant:
+            self.assertEqual(variant.size, (240, 160))
+            self.assertTrue(
+                all(channel > 245 for channel in variant.getpixel((0, 0)))
+            )
+
+    def test_transparent_rgba_gets_white_background(self):
+        self.assert_white_variant(make_png((900, 600), 'RGBA', (0, 0, 0, 0)))
+
+    def test_transparent_palette_gets_white_background(self):
+        image = Image.new('P', (900, 600), 0)
+        image.putpalette([0, 0, 0] * 256)
+        buffer = BytesIO()
+        image.save(buffer, 'PNG', transparency=0)
+        self.assert_white_variant(buffer.getvalue())
+
+
+class ShoppingListAdminTest(TestCase):
+    """Правки в админке переносятся в агрегированные списки покупок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(
+            email='admin@example.com',
+            username='admin',
+            first_name='Имя',
+            last_name='Фамилия',
+            is_staff=True,
+            is_superuser=True,
+        )
+        cls.user = CustomUser.objects.create(
+            email='user@example.com',
+            username='user',
+            first_name='Имя',
+            last_name='Фамилия',
+        )
+        cls.tag = Tag.objects.create(
+            name='Обед', color='#49B64E', slug='lunch'
+        )
+        cls.flour, cls.sugar, cls.salt = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('мука', 'сахар', 'соль')
+        ]
+        cls.recipe = Recipe.objects.create(
+            author=cls.admin, name='Пирог', text='Описание', cooking_time=30
+        )
+        cls.recipe.tags.set([cls.tag])
+        cls.flour_row = IngredientRecipe.objects.create(
+            recipe=cls.recipe, ingredient=cls.flour, amount=200
+        )
+        cls.sugar_row = IngredientRecipe.objects.create(
+            recipe=cls.recipe, ingredient=cls.sugar, amount=50
+        )
+        cls.cart = ShoppingCart.objects.create(
+            user=cls.user, recipe=cls.recipe
+        )
+        shopping_list.rebuild([cls.user.id])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def assert_shopping_list(self, expected):
+        self.assertEqual(
+            dict(
+                ShoppingListItem.objects.filter(user=self.user).values_list(
+                    'ingredient__name', 'amount'
+                )
+            ),
+            expected,
+        )
+
+    def test_ingredient_recipe_change_and_delete(self):
+        url = f'/admin/recipes/ingredientrecipe/{self.flour_row.pk}/'
+        self.client.post(
+            f'{url}change/',
+            {
+                'ingredient': self.salt.pk,
+                'recipe': self.recipe.pk,
+                'amount': 5,
+            },
+        )
+        self.assert_shopping_list({'соль': 5, 'сахар': 50})
+        self.client.post(f'{url}delete/', {'post': 'yes'})
+        self.assert_shopping_list({'сахар': 50})
+
+    def test_recipe_inline_change(self):
+        prefix = 'ingredientrecipe_set'
+        self.client.post(
+            f'/admin/recipes/recipe/{self.recipe.pk}/change/',
+            {
+                'author': self.admin.pk,
+                'name': 'Пирог',
+                'image': make_upload(),
+                'text': 'Описание',
+                'tags': [self.tag.pk],
+                'cooking_time': 30,
+                f'{prefix}-TOTAL_FORMS': 3,
+                f'{prefix}-INITIAL_FORMS': 2,
+                f'{prefix}-MIN_NUM_FORMS': 1,
+                f'{prefix}-MAX_NUM_FORMS': 1000,
+                f'{prefix}-0-id': self.flour_row.pk,
+                f'{prefix}-0-recipe': self.recipe.pk,
+                f'{prefix}-0-ingredient': self.flour.pk,
+                f'{prefix}-0-amount': 300,
+                f'{prefix}-1-id': self.sugar_row.pk,
+                f'{prefix}-1-recipe': self.recipe.pk,
+                f'{prefix}-1-ingredient': self.sugar.pk,
+                f'{prefix}-1-amount': 50,
+                f'{prefix}-1-DELETE': 'on',
+                f'{prefix}-2-recipe': self.recipe.pk,
+                f'{prefix}-2-ingredient': self.salt.pk,
+                f'{prefix}-2-amount': 3,
+            },
+        )
+        self.assert_shopping_list({'мука': 300, 'соль': 3})
+
+    def test_shopping_cart_add_and_delete(self):
+        self.client.post(
+            f'/admin/recipes/shoppingcart/{self.cart.pk}/delete/',
+            {'post': 'yes'},
+        )
+        self.assert_shopping_list({})
+        self.client.post(
+            '/admin/recipes/shoppingcart/add/',
+            {'user': self.user.pk, 'recipe': self.recipe.pk},
+        )
+        self.assert_shopping_list({'мука': 200, 'сахар': 50})
+
+
+class RecipeSearchTest(TestCase):
+    """Поиск возвращает все совпадения, их количество видно пагинации."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = CustomUser.objects.create(
+            email='author@example.com',
+            username='author',
+            first_name='Имя',
+            last_name='Фамилия',
+        )
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=author,
+                name=f'Суп {number}' if number % 2 else f'Каша {number}',
+                text='Описание',
+                cooking_time=10,
+            )
+            for number in range(800)
+        )
+        recipe_search_index.invalidate()
+
+    def test_all_matches_are_returned(self):
+        self.assertEqual(
+            search_recipes(Recipe.objects.all(), 'суп').count(), 400
+        )
+
+
+SHARED_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': 'localhost:11211',
+    }
+}
+
+
+class CountingIndex(VersionedIndex):
+    version_key = 'test_index_version'
+
+    def __init__(self):
+        super().__init__()
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+
+
+@override_settings(SEARCH_INDEX_CHECK_INTERVAL=60)
+class VersionedIndexTest(TestCase):
+    """Версия индекса сверяется с кэшем не чаще заданного интервала."""
+
+    def setUp(self):
+        cache.delete(CountingIndex.version_key)
+        self.index = CountingIndex()
+
+    def test_version_is_checked_once_per_interval(self):
+        with mock.patch('recipes.search.time.monotonic', return_value=100):
+            self.index.ensure_built()
+            cache.incr(CountingIndex.version_key)
+            with mock.patch('recipes.search.cache.get_or_set') as get_or_set:
+                self.index.ensure_built()
+            get_or_set.assert_not_called()
+        self.assertEqual(self.index.builds, 1)
+        with mock.patch('recipes.search.time.monotonic', return_value=161):
+            self.index.ensure_built()
+        self.assertEqual(self.index.builds, 2)
+
+    def test_invalidate_rebuilds_immediately(self):
+        self.index.ensure_built()
+        self.index.invalidate()
+        self.index.ensure_built()
+        self.assertEqual(self.index.builds, 2)
+
+    def test_ingredient_index_requires_shared_cache(self):
+        with override_settings(INGREDIENT_SEARCH_INDEX=True):
+            with self.assertRaises(ImproperlyConfigured):
+                check_ingredient_index_cache()
+            with override_settings(CACHES=SHARED_CACHES):
+                check_ingredient_index_cache()